@@ -0,0 +1,206 @@
+"""
+
+archives (python3)
+
+    Indexed spot price archives in Amazon S3.
+
+    Archive objects are newline delimited json, written as chunks of
+    records sharing (InstanceType, AvailabilityZone, hour).  Every chunk
+    is independently decodable.  A small sidecar index object (archive
+    key + '.idx') maps each chunk to its byte range, in two levels:  one
+    entry per (InstanceType, AZ) series holding the byte offset of its
+    first chunk, then one [period, length, count] entry per chunk, where
+    period counts hours (days) since the index start label:
+
+        {"records": n, "period": "hour", "start": "2020-01-01T00",
+         "series": [[InstanceType, AZ, offset, [[period, length, count], ...]], ...]}
+
+    Chunks of a series are contiguous and series are ordered by instance
+    type, so readers interested in one instance type issue a single
+    ranged GET rather than downloading and parsing the whole region
+    archive.  index_chunks() expands this index into one entry per chunk.
+
+    Compacted archives (see compaction) group chunks by day rather than
+    hour and are written one day after another, so a series has one
+    index entry per day.  Each chunk is gzipped as a separate member; the concatenation of
+    members is itself a valid gzip stream, so whole objects and ranged
+    reads decode alike.
+
+"""
+import gzip
+import datetime
+import boto3
+from botocore.exceptions import ClientError
+from timestamps import to_epoch
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+INDEX_SUFFIX = '.idx'
+
+# chunk period --> (label format, e.g. 2020-01-01T05, hours per period)
+PERIODS = {'hour': ('%Y-%m-%dT%H', 1), 'day': ('%Y-%m-%d', 24)}
+
+
+def period_label(number, period):
+    """Label of a period, numbered from the epoch"""
+    fmt, hours = PERIODS[period]
+    return datetime.datetime.utcfromtimestamp(number * hours * 3600).strftime(fmt)
+
+
+def period_number(label, period):
+    """Inverse of period_label"""
+    fmt, hours = PERIODS[period]
+    dt = datetime.datetime.strptime(label, fmt).replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp()) // (hours * 3600)
+
+
+def build_archive(records, period='hour', compress=False):
+    """
+    Summary.
+
+        Encodes records as chunked newline delimited json
+
+    Args:
+        :records (list):  spot price dictionaries
+        :period (str):  chunk period, 'hour' or 'day'
+        :compress (bool):  gzip each chunk
+
+    Returns:
+        (archive body, index), TYPE: tuple (bytes, dict)
+
+    """
+    seconds = PERIODS[period][1] * 3600
+    groups = {}
+    for record in records:
+        key = (record['InstanceType'], record['AvailabilityZone'], to_epoch(record['Timestamp']) // seconds)
+        groups.setdefault(key, []).append(record)
+
+    first = min(x[2] for x in groups) if groups else 0
+    parts, series, offset = [], [], 0
+    for key in sorted(groups):
+        chunk = b''.join(serializers.dumps(x) + b'\n' for x in groups[key])
+        if compress:
+            chunk = gzip.compress(chunk)
+        parts.append(chunk)
+        if not series or series[-1][0] != key[0] or series[-1][1] != key[1]:
+            series.append([key[0], key[1], offset, []])
+        series[-1][3].append([key[2] - first, len(chunk), len(groups[key])])
+        offset += len(chunk)
+
+    index = {'records': len(records), 'period': period, 'start': period_label(first, period), 'series': series}
+    return b''.join(parts), index
+
+
+def index_chunks(index):
+    """
+    Summary.
+
+        Expands an archive index into one entry per chunk
+
+    Returns:
+        [InstanceType, AZ, period label, offset, length, count] per chunk,
+        TYPE: list
+
+    """
+    first = period_number(index['start'], index['period'])
+    chunks = []
+    for itype, az, offset, periods in index['series']:
+        for number, length, count in periods:
+            chunks.append([itype, az, period_label(first + number, index['period']), offset, length, count])
+            offset += length
+    return chunks
+
+
+def decode_chunk(data):
+    """Decodes one or more whole chunks of an archive body"""
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return [serializers.loads(x) for x in data.splitlines() if x]
+
+
+def read_archive(body):
+    """
+        Decodes a complete archive body; reads both indexed (newline
+        delimited) and legacy {'SpotPriceHistory': [...]} documents
+    """
+    if body[:2] == b'\x1f\x8b':
+        return decode_chunk(body)
+    head = body[:64].replace(b' ', b'').replace(b'\n', b'')
+    if head.startswith(b'{"SpotPriceHistory"'):
+        return serializers.loads(body)['SpotPriceHistory']
+    return decode_chunk(body)
+
+
+def upload_archive(bucket, records, key):
+    """
+    Summary.
+
+        Writes an indexed archive and its sidecar index to Amazon S3.
+        The index is written after the archive body, so an index always
+        describes a complete object
+
+    Returns:
+        Success | Failure, TYPE: bool
+
+    """
+    body, index = build_archive(records)
+    try:
+        s3client = boto3.client('s3')
+        s3client.put_object(Bucket=bucket, Key=key, Body=body)
+        s3client.put_object(Bucket=bucket, Key=key + INDEX_SUFFIX, Body=serializers.dumps(index))
+    except ClientError as e:
+        logger.exception('Problem writing archive {}: {}'.format(key, e))
+        return False
+    return True
+
+
+def _coalesce(chunks):
+    """Merges byte ranges of adjacent chunks into (start, end) inclusive ranges"""
+    ranges = []
+    for chunk in sorted(chunks, key=lambda x: x[3]):
+        start, end = chunk[3], chunk[3] + chunk[4] - 1
+        if ranges and ranges[-1][1] + 1 == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def read_slice(bucket, key, instance_type=None, az=None, hour=None):
+    """
+    Summary.
+
+        Reads only the archive chunks matching the given filters using
+        ranged GET requests
+
+    Args:
+        :bucket (str):  archive bucket
+        :key (str):  archive object key
+        :instance_type (str):  InstanceType filter
+        :az (str):  AvailabilityZone filter
+        :hour (str):  hour filter, format 2020-01-01T05; matches the day
+            chunk containing the hour in compacted archives
+
+    Returns:
+        spot price dictionaries, TYPE: list
+
+    """
+    s3client = boto3.client('s3')
+    index = serializers.loads(
+        s3client.get_object(Bucket=bucket, Key=key + INDEX_SUFFIX)['Body'].read()
+    )
+    selected = [
+        x for x in index_chunks(index)
+        if (instance_type is None or x[0] == instance_type)
+        and (az is None or x[1] == az)
+        and (hour is None or hour.startswith(x[2]))
+    ]
+
+    records = []
+    for start, end in _coalesce(selected):
+        data = s3client.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end))['Body'].read()
+        records.extend(decode_chunk(data))
+    return records
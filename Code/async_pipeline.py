@@ -0,0 +1,337 @@
+"""
+
+async_pipeline (python3)
+
+    Alternative asyncio runtime for the spot price loader.
+
+    EC2 price history pagination, DynamoDB batch writes and S3 multipart
+    archive uploads for every target region run concurrently under a
+    single event loop (aiobotocore), bounded by per-service concurrency
+    limits rather than one OS thread per request:
+
+        ASYNC_EC2_CONCURRENCY       concurrent EC2 paginations (default 8)
+        ASYNC_DYNAMODB_CONCURRENCY  in-flight BatchWriteItem calls (default 32)
+        ASYNC_S3_CONCURRENCY        in-flight S3 part uploads (default 8)
+
+    Blocking boto3 work runs in the default executor so it never stalls
+    the event loop:  the on-demand catalog and change detector snapshots
+    are handled once per run, outside the region coroutines, and each
+    region's quarantine of rejected records is uploaded from its
+    coroutine.  The handler returns
+    the same shard statistics as cli.lambda_handler and reports them the
+    same way, including the S3 result read by orchestrator.reduce_handler.
+
+    Lambda handler:  async_pipeline.lambda_handler
+
+"""
+import os
+import time
+import asyncio
+import datetime
+from botocore.exceptions import ClientError
+from pyaws.awslambda import read_env_variable
+from archives import INDEX_SUFFIX, build_archive
+from changefeed import save_state
+from cli import (archive_filename, change_detector, default_endpoints, open_quarantine, price_item, s3upload,
+                 source_environment, upload_quarantine)
+from ondemand import get_catalog
+from reporting import prefetch_identity, report
+from timestamps import normalize_timestamps
+from validation import validate_records
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+try:
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+# DynamoDB BatchWriteItem maximum items per request
+BATCH_SIZE = 25
+
+# S3 multipart minimum part size is 5 MB
+PART_SIZE = 8 * 1024 * 1024
+
+
+def _limit(env_variable, default):
+    return asyncio.Semaphore(int(read_env_variable(env_variable, default)))
+
+
+async def fetch_region_prices(session, region, start, end, limit):
+    """
+    Summary.
+
+        Paginates EC2 spot price history for one region
+
+    Args:
+        :session (aiobotocore.session.AioSession):  aiobotocore session
+        :region (str):  AWS region code
+        :start, end (datetime):  retrieval window
+        :limit (asyncio.Semaphore):  EC2 concurrency limit
+
+    Returns:
+        spot price dictionaries, TYPE: list
+
+    """
+    prices = []
+    async with limit:
+        async with session.create_client('ec2', region_name=region) as client:
+            paginator = client.get_paginator('describe_spot_price_history')
+            async for page in paginator.paginate(
+                    StartTime=start, EndTime=end, PaginationConfig={'PageSize': 1000}):
+                prices.extend(page['SpotPriceHistory'])
+    logger.info('Retrieved {} spot price records for region {}'.format(len(prices), region))
+    return prices
+
+
+async def _write_batch(client, table_name, requests, limit, progress, retries=5):
+    """
+        BatchWriteItem with exponential backoff for unprocessed items;
+        returns the requests still unprocessed after the last attempt
+    """
+    total = len(requests)
+    async with limit:
+        for attempt in range(retries):
+            response = await client.batch_write_item(RequestItems={table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+            if not requests:
+                break
+            await asyncio.sleep(0.05 * 2 ** attempt)
+    progress.update(total - len(requests), errors=len(requests))
+    return requests
+
+
+async def write_prices(session, region_name, table_name, prices, region, limit, progress, ondemand):
+    """
+    Summary.
+
+        Writes spot price records to DynamoDB in concurrent batches
+
+    Args:
+        :ondemand (OnDemandCatalog):  on-demand prices, loaded once per run
+
+    Returns:
+        (items written, items failed, records committed), TYPE: tuple;
+        records superseded by a later record with the same table key
+        count as written
+
+    """
+    date = datetime.date.today().isoformat()
+
+    # one request per table key, last write wins (as batch_writer overwrite_by_pkeys);
+    # BatchWriteItem rejects a batch holding duplicate keys
+    unique = {}
+    for x in prices:
+        unique[(x['Timestamp'], x['SpotPrice'])] = x
+    records = list(unique.values())
+    requests = [
+        {'PutRequest': {'Item': {k: {'S': str(v)} for k, v in price_item(x, region, date, ondemand).items()}}}
+        for x in records
+    ]
+    batches = [requests[i:i + BATCH_SIZE] for i in range(0, len(requests), BATCH_SIZE)]
+
+    async with session.create_client('dynamodb', region_name=region_name) as client:
+        results = await asyncio.gather(
+            *[_write_batch(client, table_name, x, limit, progress) for x in batches], return_exceptions=True
+        )
+
+    failed, committed = 0, []
+    for index, (batch, result) in enumerate(zip(batches, results)):
+        if isinstance(result, Exception):
+            logger.warning('Batch write failure for region {}: {}'.format(region, result))
+            progress.update(0, errors=len(batch))
+            failed += len(batch)
+            continue
+        unprocessed = {(x['PutRequest']['Item']['Timestamp']['S'], x['PutRequest']['Item']['SpotPrice']['S'])
+                       for x in result}
+        failed += len(result)
+        committed.extend(
+            x for x in records[index * BATCH_SIZE:(index + 1) * BATCH_SIZE]
+            if (str(x['Timestamp']), x['SpotPrice']) not in unprocessed
+        )
+    return len(prices) - failed, failed, committed
+
+
+async def multipart_upload(session, bucket, key, body, limit):
+    """
+    Summary.
+
+        Uploads body to S3, in concurrent parts when larger than PART_SIZE
+
+    Returns:
+        Success | Failure, TYPE: bool
+
+    """
+    async with session.create_client('s3') as client:
+        try:
+            if len(body) <= PART_SIZE:
+                async with limit:
+                    await client.put_object(Bucket=bucket, Key=key, Body=body)
+                return True
+
+            upload_id = (await client.create_multipart_upload(Bucket=bucket, Key=key))['UploadId']
+
+            async def _part(number, offset):
+                async with limit:
+                    response = await client.upload_part(
+                        Bucket=bucket, Key=key, UploadId=upload_id,
+                        PartNumber=number, Body=body[offset:offset + PART_SIZE]
+                    )
+                return {'PartNumber': number, 'ETag': response['ETag']}
+
+            try:
+                parts = await asyncio.gather(
+                    *[_part(i + 1, x) for i, x in enumerate(range(0, len(body), PART_SIZE))]
+                )
+                await client.complete_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+                )
+            except Exception:
+                await client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+                raise
+
+        except ClientError as e:
+            logger.exception('Problem uploading {} to Amazon S3: {}'.format(key, e))
+            return False
+    return True
+
+
+async def process_region(session, region, table_region, table_name, bucket, start, end, limits, progress,
+                         ondemand, detector=None):
+    """
+        Retrieve, load and archive spot price data for one region; with a
+        detector only price changes are loaded and the detector is
+        committed past the changes written
+    """
+    prices = await fetch_region_prices(session, region, start, end, limits['ec2'])
+    normalize_timestamps(
+        prices,
+        style=source_environment('timestamp_format'),
+        workers=source_environment('normalize_workers')
+    )
+    quarantine = open_quarantine([region], start, end)
+    prices = validate_records(prices, quarantine)
+    await asyncio.get_running_loop().run_in_executor(None, upload_quarantine, quarantine, bucket)
+    retrieved = len(prices)
+    key = os.path.join(region, archive_filename(start, end))
+    body, index = build_archive(prices)
+
+    if detector is not None:
+        prices = detector.detect(prices)
+
+    (written, failed, committed), uploaded = await asyncio.gather(
+        write_prices(session, table_region, table_name, prices, region, limits['dynamodb'], progress, ondemand),
+        multipart_upload(session, bucket, key, body, limits['s3'])
+    )
+    if uploaded:
+        uploaded = await multipart_upload(
+            session, bucket, key + INDEX_SUFFIX, serializers.dumps(index), limits['s3']
+        )
+
+    # detector state moves forward only past changes written to the table
+    if detector is not None:
+        detector.commit(committed)
+    return {
+        'region': region, 'retrieved': retrieved, 'records': len(prices),
+        'written': written, 'failed': failed, 'uploaded': uploaded
+    }
+
+
+async def run_pipeline(regions, table_region, table_name, bucket, start, end):
+    """
+    Summary.
+
+        Runs the end to end spot price pipeline for all regions under
+        one event loop
+
+    Args:
+        :regions (list):  AWS region codes from which to retrieve prices
+        :table_region (str):  region of the DynamoDB price table
+        :table_name (str):  DynamoDB price table name
+        :bucket (str):  S3 archive bucket
+        :start, end (datetime):  retrieval window
+
+    Returns:
+        per region status dictionaries, TYPE: list
+
+    """
+    if get_session is None:
+        raise RuntimeError('asyncio pipeline mode requires the aiobotocore library')
+
+    limits = {
+        'ec2': _limit('ASYNC_EC2_CONCURRENCY', 8),
+        'dynamodb': _limit('ASYNC_DYNAMODB_CONCURRENCY', 32),
+        's3': _limit('ASYNC_S3_CONCURRENCY', 8)
+    }
+    loop = asyncio.get_running_loop()
+    ondemand = await loop.run_in_executor(None, get_catalog, bucket)
+    detector = None
+    if source_environment('change_feed'):
+        detector = await loop.run_in_executor(None, change_detector, regions, bucket)
+
+    session = get_session()
+    progress = loggers.ProgressLogger(logger, 'dynamodb')
+    results = await asyncio.gather(
+        *[process_region(session, x, table_region, table_name, bucket, start, end, limits, progress, ondemand, detector)
+          for x in regions]
+    )
+    progress.close()
+
+    if detector is not None:
+        await loop.run_in_executor(None, save_state, detector, bucket, regions)
+    return results
+
+
+def lambda_handler(event, context):
+    """
+    Initialize spot price operations in asyncio pipeline mode
+
+    Returns:
+        shard statistics consumed by the orchestrator, TYPE: dict
+    """
+    started = time.monotonic()
+    os.chdir('/tmp')
+    prefetch_identity()
+
+    REGION = read_env_variable('DEFAULT_REGION', 'us-east-2')
+    TABLE = read_env_variable('DYNAMODB_TABLE', 'PriceData')
+    BUCKET = read_env_variable('S3_BUCKET')
+    TARGET_REGIONS = event['detail']['responseElements'].split(',')
+
+    logger.info('<-- SPOTPRICE RETRIEVER VERSION {} START (asyncio) -->'.format(__version__))
+
+    start, end = default_endpoints()
+    results = asyncio.run(run_pipeline(TARGET_REGIONS, REGION, TABLE, BUCKET, start, end))
+
+    for result in results:
+        logger.info(
+            'Region {region}: {written} records written, {failed} failed, archive uploaded: {uploaded}'.format(**result)
+        )
+
+    # same shard statistics as cli.lambda_handler
+    result = {
+        'committed': sum(x['written'] for x in results),
+        'failed': sum(x['failed'] for x in results),
+        'remaining': 0,
+        'stopped': False,
+        'region_load': {x['region']: {'committed': x['written'], 'failed': x['failed']} for x in results},
+        'regions': TARGET_REGIONS,
+        'records': sum(x['records'] for x in results),
+        'region_records': {x['region']: x['retrieved'] for x in results},
+        'uploads': {x['region']: str(x['uploaded']) for x in results},
+        'duration': round(time.monotonic() - started, 1)
+    }
+    logger.info('<-- SPOTPRICE RETRIEVER VERSION {} END -->'.format(__version__))
+    # orchestrator shards are published once, merged, by the orchestrator
+    shard = str((event.get('detail') or {}).get('eventName', '')).startswith('OrchestratorShard')
+    result['report'] = report([result], 'SpotPrice data load summary', notify=not shard).get('published', False)
+
+    # asynchronous orchestrator shard: result collected from S3 by orchestrator.reduce_handler
+    if event.get('orchestrator'):
+        result['finished'] = time.time()
+        s3upload(event['orchestrator']['bucket'], result, event['orchestrator']['result_key'])
+    loggers.flush()
+    return result
@@ -0,0 +1,232 @@
+"""
+
+changefeed (python3)
+
+    Delta-only change detection for spot price series.
+
+    A series is one (AvailabilityZone, InstanceType, ProductDescription)
+    combination.  EC2 reports the same price for a series over long
+    stretches; ChangeDetector keeps the last known price of every series
+    and emits only price transitions, plus a periodic keyframe repeating
+    the current price so readers never need to look back further than
+    one keyframe interval.  reconstruct() rebuilds the full series from
+    the change records.
+
+    detect() leaves the series state untouched; the state only moves
+    forward through commit() with the change records the loader actually
+    wrote, so a failed or interrupted write is detected again by the next
+    run rather than silently dropped.
+
+    Detector state is snapshotted per region to Amazon S3 next to the
+    change archives, so a cold start seeds from one small object per
+    region rather than reading the price table:
+
+        changefeed/<region>/detector-state.json
+
+    Several functions (daily loader, micro-batch) share the snapshot;
+    save_state() merges the current snapshot, newest price wins, before
+    writing it back, so a container holding older state never rolls the
+    snapshot back.
+
+"""
+import sys
+from bisect import bisect_right
+import boto3
+from botocore.exceptions import ClientError
+from timestamps import to_epoch
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+# change record types
+INITIAL = 'initial'
+TRANSITION = 'transition'
+KEYFRAME = 'keyframe'
+
+
+def series_key(record):
+    """Returns the (AvailabilityZone, InstanceType, ProductDescription) key of a record"""
+    return (
+        sys.intern(record['AvailabilityZone']),
+        sys.intern(record['InstanceType']),
+        sys.intern(record['ProductDescription'])
+    )
+
+
+class ChangeDetector():
+    """
+        Tracks last known price per series; filters price samples down
+        to transitions and keyframes
+
+    Args:
+        :keyframe_hours (int):  maximum interval between two emitted
+            records of an unchanged series
+
+    """
+    def __init__(self, keyframe_hours=24):
+        self.keyframe_interval = int(keyframe_hours) * 3600
+        self.state = {}         # series key --> [price, last committed epoch]
+        self.regions = set()    # regions seeded from snapshots
+
+    def __len__(self):
+        return len(self.state)
+
+    def dumps(self, region=None):
+        """Compact snapshot of the series state, optionally of one region"""
+        return serializers.dumps({
+            '|'.join(k): v for k, v in self.state.items() if region is None or k[0].startswith(region)
+        })
+
+    def loads(self, data):
+        """Merges a snapshot into the series state; newest price wins"""
+        for k, (price, ts) in serializers.loads(data).items():
+            key = tuple(sys.intern(x) for x in k.split('|'))
+            current = self.state.get(key)
+            if current is None or ts >= current[1]:
+                self.state[key] = [price, ts]
+        return len(self.state)
+
+    def detect(self, records):
+        """
+        Summary.
+
+            Filters price samples down to change records.  The series
+            state is not modified; see commit()
+
+        Args:
+            :records (list):  spot price dictionaries, any order
+
+        Returns:
+            change records in timestamp order, each annotated with
+            key 'ChangeType', TYPE: list
+
+        """
+        changes, emitted = [], {}      # series key --> [price, epoch] emitted by this call
+
+        for record in sorted(records, key=lambda x: to_epoch(x['Timestamp'])):
+            key = series_key(record)
+            ts = to_epoch(record['Timestamp'])
+            current = emitted.get(key) or self.state.get(key)
+
+            if current is None:
+                change_type = INITIAL
+            elif ts < current[1]:
+                continue                # older than known state; already covered
+            elif record['SpotPrice'] != current[0]:
+                change_type = TRANSITION
+            elif ts - current[1] >= self.keyframe_interval:
+                change_type = KEYFRAME
+            else:
+                continue
+
+            emitted[key] = [record['SpotPrice'], ts]
+            changes.append(dict(record, ChangeType=change_type))
+        return changes
+
+    def commit(self, records):
+        """
+            Moves the series state forward past change records written to
+            the table; newest price wins
+
+        Returns:
+            number of series held, TYPE: int
+        """
+        for record in records:
+            key = series_key(record)
+            ts = to_epoch(record['Timestamp'])
+            current = self.state.get(key)
+            if current is None or ts >= current[1]:
+                self.state[key] = [record['SpotPrice'], ts]
+        return len(self.state)
+
+
+def reconstruct(changes, sample_times):
+    """
+    Summary.
+
+        Rebuilds full price series from change records
+
+    Args:
+        :changes (list):  change records emitted by ChangeDetector.detect
+        :sample_times (list):  timestamps (any normalized style) at which
+            to report the price in effect
+
+    Returns:
+        series key --> list of (timestamp, price) tuples, TYPE: dict
+
+    """
+    series = {}
+
+    for record in sorted(changes, key=lambda x: to_epoch(x['Timestamp'])):
+        times, prices = series.setdefault(series_key(record), ([], []))
+        times.append(to_epoch(record['Timestamp']))
+        prices.append(record['SpotPrice'])
+
+    rebuilt = {}
+    for key, (times, prices) in series.items():
+        points = []
+        for sample in sample_times:
+            index = bisect_right(times, to_epoch(sample)) - 1
+            if index >= 0:
+                points.append((sample, prices[index]))
+        rebuilt[key] = points
+    return rebuilt
+
+
+def state_key(region):
+    return 'changefeed/{}/detector-state.json'.format(region)
+
+
+def load_state(detector, bucket, regions):
+    """
+    Summary.
+
+        Seeds a detector from the S3 state snapshots of regions not yet
+        seeded.  A region without a snapshot starts empty:  its first
+        run emits an initial record per series
+
+    Returns:
+        number of series held, TYPE: int
+
+    """
+    s3client = boto3.client('s3')
+
+    for region in [x for x in regions if x not in detector.regions]:
+        try:
+            body = s3client.get_object(Bucket=bucket, Key=state_key(region))['Body'].read()
+            detector.loads(body)
+        except ClientError as e:
+            logger.info('No change detector state for region {}: {}'.format(region, e))
+        detector.regions.add(region)
+    return len(detector)
+
+
+def save_state(detector, bucket, regions):
+    """
+    Summary.
+
+        Writes the state snapshot of each region, merged newest-wins with
+        the snapshot currently stored by any other writer
+
+    Returns:
+        region --> Success | Failure, TYPE: dict
+
+    """
+    s3client = boto3.client('s3')
+    status = {}
+
+    for region in regions:
+        try:
+            try:
+                detector.loads(s3client.get_object(Bucket=bucket, Key=state_key(region))['Body'].read())
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                    raise
+            s3client.put_object(Bucket=bucket, Key=state_key(region), Body=detector.dumps(region))
+            status[region] = True
+        except ClientError as e:
+            logger.exception('Problem writing change detector state {}: {}'.format(state_key(region), e))
+            status[region] = False
+    return status
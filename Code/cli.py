@@ -26,17 +26,24 @@ SOFTWARE.
 import os
 import sys
 import datetime
-import json
-import inspect
 import subprocess
+import time
 import boto3
 import threading
 from botocore.exceptions import ClientError
-from spotlib import SpotPrices, UtcConversion
-from libtools.js import export_iterobject
+from spotlib import SpotPrices
 from libtools.oscodes_unix import exit_codes
 from pyaws.awslambda import read_env_variable
-from lambda_utils import sns_notification
+from archives import upload_archive
+from changefeed import ChangeDetector, load_state, save_state
+from ondemand import get_catalog
+from reporting import prefetch_identity, report
+from spool import Spool, remove_stale, spool_path, window_digest
+from scheduler import partition_schedule
+from sketches import sketch_records, upload_sketches
+from timestamps import standardize_datetime, utc_datetime, datetimify_standard, normalize_timestamps
+from validation import Quarantine, price_value, validate_records
+import serializers
 import loggers
 from _version import __version__
 
@@ -44,7 +51,7 @@ logger = loggers.getLogger(__version__)
 
 # globals
 module = os.path.basename(__file__)
-sns_arn = read_env_variable('SNS_TOPIC_ARN')
+detector = None         # change detector state persists across warm invocations
 
 
 def _debug_output(*args):
@@ -61,19 +68,6 @@ def _get_regions():
     return [x['RegionName'] for x in client.describe_regions()['Regions']]
 
 
-def standardize_datetime(dt):
-    return dt.strftime('%Y-%m-%d %H:%M:%S')
-
-
-def utc_datetime(dt):
-    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-
-def datetimify_standard(s):
-    """Function to create timezone unaware string"""
-    return datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
-
-
 def default_endpoints(duration_days=1):
     """
     Supplies the default start and end datetime objects in absence
@@ -104,6 +98,43 @@ def format_pricefile(key):
     return region + delimiter + pricefile
 
 
+def archive_filename(start, end, suffix='all-instance-spot-prices.jsonl'):
+    """Filename of spot price archive covering start to end datetimes"""
+    return '_'.join(
+                [
+                    start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    suffix
+                ]
+            )
+
+
+def price_item(item, region_name, record_date, ondemand=None):
+    """
+        Maps a spot price record to the DynamoDB item schema
+            - Partition Key:  Timestamp
+            - Sort Key: Spot Price
+
+        OnDemandPrice is joined from the on-demand catalog (ondemand);
+        omitted when the catalog holds no price for the series
+    """
+    dynamodb_item = {
+            'RegionName':  region_name,
+            'AvailabilityZone': item['AvailabilityZone'],
+            'InstanceType': item['InstanceType'],
+            'ProductDescription': item['ProductDescription'],
+            'SpotPrice': item['SpotPrice'],
+            'Timestamp': item['Timestamp'],
+            'Unit': 'USD/ Hr',
+            'RecordDate':  record_date
+    }
+    if ondemand is not None:
+        price = ondemand.lookup(region_name, item['InstanceType'], item['ProductDescription'])
+        if price is not None:
+            dynamodb_item['OnDemandPrice'] = price
+    return dynamodb_item
+
+
 def summary_statistics(data, instances):
     """
     Calculate stats across spot price data elements retrieved
@@ -128,7 +159,7 @@ def summary_statistics(data, instances):
             continue
 
         instance_dict['InstanceType'] = str(itype)
-        instance_dict['AvgPrice'] = sum([float(x['SpotPrice']) for x in cur_type]) / len(cur_type)
+        instance_dict['AvgPrice'] = sum([price_value(x) for x in cur_type]) / len(cur_type)
         container.append(instance_dict)
     # output to stdout
     print_ending_summary(instances, container)
@@ -158,7 +189,13 @@ def source_environment(env_variable):
     return {
         'duration_days': read_env_variable('DEFAULT_DURATION'),
         'page_size': read_env_variable('PAGE_SIZE', 700),
-        'bucket': read_env_variable('S3_BUCKET', None)
+        'bucket': read_env_variable('S3_BUCKET', None),
+        'timestamp_format': read_env_variable('TIMESTAMP_FORMAT', 'iso'),
+        'normalize_workers': int(read_env_variable('NORMALIZE_WORKERS', 1)),
+        'change_feed': read_env_variable('CHANGE_FEED', 'False') in ('true', 'True'),
+        'keyframe_hours': int(read_env_variable('KEYFRAME_HOURS', 24)),
+        'shutdown_reserve': int(read_env_variable('SHUTDOWN_RESERVE', 90)),
+        'sketches': read_env_variable('PRICE_SKETCHES', 'True') in ('true', 'True')
     }.get(env_variable, None)
 
 
@@ -172,8 +209,8 @@ def s3upload(bucket, s3object, key):
     try:
         session = boto3.Session()
         s3client = session.client('s3')
-        # dict --> str -->  bytes (utf-8 encoded)
-        bcontainer = json.dumps(s3object, indent=4, default=str).encode('utf-8')
+        # dict --> bytes (utf-8 encoded), compact
+        bcontainer = serializers.dumps(s3object)
         response = s3client.put_object(Bucket=bucket, Body=bcontainer, Key=key)
 
         # http completion code
@@ -213,7 +250,7 @@ def writeout_data(key, jsonobject, filename):
     """
     tab = '\t'.expandtabs(13)
 
-    if export_iterobject({key: jsonobject}, filename):
+    if serializers.dump_file({key: jsonobject}, filename):
         success = f'Wrote {filename}\n{tab}successfully to local filesystem'
         logger.info(success)
         return True
@@ -234,7 +271,15 @@ class AssignRegion():
 
 
 class DynamoDBPrices(threading.Thread):
-    def __init__(self, region, table_name, price_dicts, start_date, end_date):
+    """
+        Loads spot price records into DynamoDB in batches of BATCH_SIZE.
+        The shared stop_event is checked between batches; the batch in
+        flight when stop is requested is flushed before the thread exits
+    """
+    BATCH_SIZE = 25
+
+    def __init__(self, region, table_name, price_dicts, start_date, end_date, stop_event=None, progress=None,
+                 spool=None, offsets=None, ondemand=None):
         super(DynamoDBPrices, self).__init__()
         self.ar = AssignRegion()
         self.sp = SpotPrices(start_dt=start_date, end_dt=end_date)
@@ -242,66 +287,188 @@ class DynamoDBPrices(threading.Thread):
         self.dynamodb = boto3.resource('dynamodb', region_name=region)
         self.table = self.dynamodb.Table(table_name)
         self.prices = price_dicts
-        self.running = False
-
-    def start(self):
-        self.running = True
-        super(DynamoDBPrices, self).start()
+        self.stop_event = stop_event or threading.Event()
+        self.progress = progress or loggers.ProgressLogger(logger, 'dynamodb', total=len(price_dicts))
+        self.spool = spool
+        self.offsets = offsets
+        self.ondemand = ondemand
+        self.committed = 0
+        self.failed = 0
+        self.committed_batches = []     # start index of each committed batch in prices
+        self.region_load = {}       # region --> {'committed': n, 'failed': n}
+
+    @property
+    def running(self):
+        return self.is_alive() and not self.stop_event.is_set()
+
+    @property
+    def remaining(self):
+        """Records neither committed nor failed"""
+        return len(self.prices) - self.committed - self.failed
+
+    def committed_records(self):
+        """Records of the batches written successfully, TYPE: generator"""
+        for index in self.committed_batches:
+            yield from self.prices[index:index + self.BATCH_SIZE]
 
     def run(self):
         """
             Inserts data items into DynamoDB table
                 - Partition Key:  Timestamp
                 - Sort Key: Spot Price
-        Args:
-            region_list (list): AWS region code list from which to gen price data
 
         Returns:
-            dynamodb table object
+            None; progress is recorded in committed, failed, remaining
 
         """
-        date = datetime.date.today()
+        date = datetime.date.today().isoformat()
+
+        for index in range(0, len(self.prices), self.BATCH_SIZE):
+            if self.stop_event.is_set():
+                logger.warning('{}: stop requested, {} records not loaded'.format(self.name, self.remaining))
+                break
 
-        for item in self.prices:
+            batch = self.prices[index:index + self.BATCH_SIZE]
+            regions = [self.ar.assign_region(x['AvailabilityZone']) for x in batch]
             try:
-                self.table.put_item(
-                    Item={
-                            'RegionName':  self.ar.assign_region(item['AvailabilityZone']),
-                            'AvailabilityZone': item['AvailabilityZone'],
-                            'InstanceType': item['InstanceType'],
-                            'ProductDescription': item['ProductDescription'],
-                            'SpotPrice': item['SpotPrice'],
-                            'Timestamp': item['Timestamp'],
-                            'OnDemandPrice': "0.12456789",
-                            'Unit': 'USD/ Hr',
-                            'RecordDate':  date.isoformat()
-                    }
-                )
-                logger.info(
-                    'Successful put item for AZ {} at time {}'.format(item['AvailabilityZone'], item['Timestamp'])
-                )
-                if not self.running:
-                    break
+                with self.table.batch_writer(overwrite_by_pkeys=['Timestamp', 'SpotPrice']) as writer:
+                    for item, region in zip(batch, regions):
+                        writer.put_item(Item=price_item(item, region, date, self.ondemand))
+                self.committed += len(batch)
+                self.committed_batches.append(index)
+                self._count(regions, 'committed')
+                self.progress.update(len(batch))
+                if self.spool is not None:
+                    self.spool.ack('dynamodb', self.offsets[index:index + self.BATCH_SIZE])
             except ClientError as e:
-                logger.info(f'Error inserting item {item}: \n\n{e}')
+                self.failed += len(batch)
+                self._count(regions, 'failed')
+                self.progress.update(0, errors=len(batch))
+                logger.warning(f'Error inserting batch of {len(batch)} items: {e}')
                 continue
 
-    def stop(self):
-        self.running = False
-        self.join()  # wait for run() method to terminate
+    def _count(self, regions, outcome):
+        for region in regions:
+            counts = self.region_load.setdefault(region, {'committed': 0, 'failed': 0})
+            counts[outcome] += 1
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.join(timeout)  # wait for run() method to flush batch in flight
         sys.stdout.flush()
 
 
-def download_spotprice_data(region_list):
-    sp = SpotPrices()
+def join_workers(workers, context=None, reserve=60, grace=10):
+    """
+    Summary.
+
+        Joins loader threads within the remaining Lambda execution time.
+        Workers still running when the deadline arrives are signalled to
+        stop and given a grace period to flush the batch in flight
+
+    Args:
+        :workers (list):  DynamoDBPrices thread objects sharing a stop event
+        :context (LambdaContext):  lambda context object; None joins
+            without a deadline
+        :reserve (int):  seconds of execution time held back for archive
+            uploads and reporting
+        :grace (int):  seconds allowed for workers to flush after stop
+
+    Returns:
+        load status, TYPE: dict; keys: committed, failed, remaining, stopped,
+        region_load
+
+    """
+    if context is not None:
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - reserve
+        for worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+    else:
+        for worker in workers:
+            worker.join()
+
+    stopped = any(x.is_alive() for x in workers)
+
+    if stopped:
+        logger.warning('Lambda deadline approaching, stopping {} loader threads'.format(
+            len([x for x in workers if x.is_alive()])))
+        for worker in workers:
+            worker.stop_event.set()
+        for worker in workers:
+            worker.join(grace)
+
+    status = {
+        'committed': sum(x.committed for x in workers),
+        'failed': sum(x.failed for x in workers),
+        'remaining': sum(x.remaining for x in workers),
+        'stopped': stopped,
+        'region_load': {}
+    }
+    for worker in workers:
+        for region, counts in worker.region_load.items():
+            totals = status['region_load'].setdefault(region, {'committed': 0, 'failed': 0})
+            totals['committed'] += counts['committed']
+            totals['failed'] += counts['failed']
+    logger.info('DynamoDB load: {committed} records committed, {failed} failed, {remaining} remain'.format(**status))
+    return status
+
+
+def open_quarantine(regions, start, end):
+    """
+        Quarantine of rejected records, named for the retrieval window and
+        region set so concurrent loads never overwrite each other
+    """
+    suffix = 'rejected-spot-prices-{}.jsonl'.format(window_digest(regions, start, end))
+    return Quarantine(os.path.join('/tmp', archive_filename(start, end, suffix)))
+
+
+def upload_quarantine(quarantine, bucket):
+    """Copies a non-empty quarantine to Amazon S3 under quarantine/"""
+    if quarantine.close():
+        return quarantine.upload(bucket, os.path.join('quarantine', os.path.basename(quarantine.path)))
+    return True
+
+
+def download_spotprice_data(region_list, start_dt=None, end_dt=None, quarantine=None):
+    sp = SpotPrices(start_dt=start_dt, end_dt=end_dt) if start_dt else SpotPrices()
     start = sp.start.strftime("%Y-%m-%dT%H:%M:%S")
     end = sp.end.strftime("%Y-%m-%dT%H:%M:%S")
     # log datetime range of data pull
     logger.info('Spot Price data retrieval start: {}'.format(start))
     logger.info('Spot Price data retrieval end: {}'.format(end))
     prices = sp.generate_pricedata(regions=region_list)
-    uc = UtcConversion(prices)      # converts datatime objects to str date times
-    return prices['SpotPriceHistory']
+    # converts datetime objects to str date times (or epoch seconds text)
+    records = normalize_timestamps(
+                prices['SpotPriceHistory'],
+                style=source_environment('timestamp_format'),
+                workers=source_environment('normalize_workers')
+            )
+    # schema checks; rejected records routed to quarantine
+    return validate_records(records, quarantine)
+
+
+def change_detector(regions, bucket):
+    """
+    Summary.
+
+        Returns the container's change detector, seeded with last known
+        prices of regions from their S3 state snapshots on first use
+
+    Args:
+        :regions (list):  AWS region codes about to be processed
+        :bucket (str):  archive bucket holding the state snapshots
+
+    Returns:
+        changefeed.ChangeDetector
+
+    """
+    global detector
+
+    if detector is None:
+        detector = ChangeDetector(keyframe_hours=source_environment('keyframe_hours'))
+    if set(regions) - detector.regions:
+        logger.info('Change detector seeded with {} series'.format(load_state(detector, bucket, regions)))
+    return detector
 
 
 def set_tempdirectory():
@@ -312,44 +479,21 @@ def set_tempdirectory():
     subprocess.getoutput('export TMPDIR=/tmp')
 
 
-def summary_report(upload_status, *args):
-    """Log summary ending report statistics"""
-    box = []
-    try:
-        logger.info('SPOTPRICE LOADER ENDING SUMMARY REPORT:')
-
-        for index, arg in enumerate(args):
-            box.append(arg)
-            logger.info('\t- Processed {} records for Thread{}'.format(len(arg), index + 1))
-        logger.info('Raw data archive upload to Amazon S3:')
-
-        # print out s3 upload status for raw data archives
-        for k, v in upload_status.items():
-            logger.info('Region {} upload complete status: {}'.format(k, v))
-        logger.info('<-- SPOTPRICE RETRIEVER VERSION {} END -->'.format(__version__))
-
-        # SNS Report
-        topic = sns_arn
-        subject = 'SpotPrice data S3 Upload Status'
-        p1, p2, p3, p4 = [x for x in box]
-        msg = 'Records processed:\n\t- Thread 1: {},\n\t- Thread 2: {},\n\t- Thread 3: {},\n\t- Thread 4: {}'.format(len(p1), len(p2), len(p3), len(p4))
-        sns_notification(topic, subject, msg)
-    except Exception as e:
-        fx = inspect.stack()[0][3]
-        logger.exception('{}: Unknown error generating summary report: {}'.format(fx, e))
-        return False
-    return True
-
-
 def lambda_handler(event, context):
     """
     Initialize spot price operations; process command line parameters
+
+    Returns:
+        shard statistics consumed by the orchestrator, TYPE: dict
     """
+    started = time.monotonic()
+
     # change to writeable filesystem
     os.chdir('/tmp')
     logger.info('PWD is {}'.format(os.getcwd()))
 
     set_tempdirectory()
+    prefetch_identity()
 
     # set local region, dynamoDB table
     REGION = read_env_variable('DEFAULT_REGION', 'us-east-2')
@@ -370,7 +514,7 @@ def lambda_handler(event, context):
 
         if DBUGMODE:
             print('Received event: ')
-            print(json.dumps(event, indent=2))
+            print(serializers.dumps(event, pretty=True).decode('utf-8'))
         # parse event
         region = event['region']
         detail = event['detail']
@@ -386,10 +530,44 @@ def lambda_handler(event, context):
     # create dt object start, end datetimes
     start, end = default_endpoints()
 
-    price_list = download_spotprice_data(TARGET_REGIONS)
+    # stage records in /tmp spool; a warm retry replays uncommitted records
+    spool = Spool(spool_path(TARGET_REGIONS, start, end))
+    remove_stale(spool.path)
+
+    if spool.sealed:
+        logger.info('Replaying spool {} from offset {}'.format(spool.path, spool.committed('dynamodb')))
+    else:
+        quarantine = open_quarantine(TARGET_REGIONS, start, end)
+        price_list = download_spotprice_data(TARGET_REGIONS, quarantine=quarantine)
+        upload_quarantine(quarantine, BUCKET)
+
+        # price quantile sketches of every retrieved sample, written before the
+        # spool is sealed:  a spool replay leaves the complete objects in place
+        if source_environment('sketches'):
+            upload_sketches(BUCKET, sketch_records(price_list, TARGET_REGIONS), start.date())
 
-    # divide price list into multiple parts for parallel processing
-    prices1, prices2, prices3, prices4 = split_list(price_list, 4)
+        # reduce price samples to transitions + keyframes
+        if source_environment('change_feed'):
+            samples = len(price_list)
+            price_list = change_detector(TARGET_REGIONS, BUCKET).detect(price_list)
+            logger.info('Change feed: {} of {} price samples are changes'.format(len(price_list), samples))
+
+        try:
+            logger.info('Spooled {} records to {}'.format(spool.write(price_list), spool.path))
+        except OSError as e:
+            logger.error('Spool unavailable ({}); loading without replay'.format(e))
+            spool = None
+
+    if spool is not None:
+        price_list, offsets = spool.pending('dynamodb')
+    else:
+        offsets = [None] * len(price_list)
+    records = len(price_list)
+    loaded = price_list
+
+    # divide price list into parts for parallel processing, interleaved by partition key
+    schedule = partition_schedule(price_list, 4, batch_size=DynamoDBPrices.BATCH_SIZE)
+    prices1, prices2, prices3, prices4 = [[price_list[i] for i in x] for x in schedule]
 
     logger.info('prices1 contains: {} elements'.format(len(prices1)))
     logger.info('prices2 contains: {} elements'.format(len(prices2)))
@@ -397,68 +575,60 @@ def lambda_handler(event, context):
     logger.info('prices4 contains: {} elements'.format(len(prices4)))
 
     # prepare parallel thread facilities for dynamoDB loading
-    db1 = DynamoDBPrices(
+    stop_event = threading.Event()
+    progress = loggers.ProgressLogger(logger, 'dynamodb', total=len(price_list))
+    ondemand = get_catalog(BUCKET)
+    workers = [
+        DynamoDBPrices(
             region=REGION,
             table_name=TABLE,
-            price_dicts=prices1,
+            price_dicts=x,
             start_date=start,
-            end_date=end
-        )
-
-    db2 = DynamoDBPrices(
-            region=REGION,
-            table_name=TABLE,
-            price_dicts=prices2,
-            start_date=start,
-            end_date=end
-        )
-
-    db3 = DynamoDBPrices(
-            region=REGION,
-            table_name=TABLE,
-            price_dicts=prices3,
-            start_date=start,
-            end_date=end
-        )
-
-    db4 = DynamoDBPrices(
-            region=REGION,
-            table_name=TABLE,
-            price_dicts=prices4,
-            start_date=start,
-            end_date=end
-        )
+            end_date=end,
+            stop_event=stop_event,
+            progress=progress,
+            spool=spool,
+            offsets=y,
+            ondemand=ondemand
+        ) for x, y in zip((prices1, prices2, prices3, prices4), [[offsets[i] for i in x] for x in schedule])
+    ]
 
     # retrieve spot data, insert into dynamodb
-    db1.start()
-    db2.start()
-    db3.start()
-    db4.start()
-
-    # need to join, concurrent end to all threads
-    db1.join()
-    db2.join()
-    db3.join()
-    db4.join()
+    for worker in workers:
+        worker.start()
+
+    # concurrent end to all threads, bounded by remaining lambda time
+    load_status = join_workers(workers, context, reserve=source_environment('shutdown_reserve'))
+    progress.close()
+
+    # detector state moves forward only past changes written to the table
+    if source_environment('change_feed'):
+        change_detector(TARGET_REGIONS, BUCKET).commit(x for worker in workers for x in worker.committed_records())
+        save_state(detector, BUCKET, TARGET_REGIONS)
+
+        # change archive records, decoded once and grouped by region
+        region_changes = {x: [] for x in TARGET_REGIONS}
+        for record in ((x for _, _, x in spool.read()) if spool is not None else loaded):
+            for region in TARGET_REGIONS:
+                if record['AvailabilityZone'].startswith(region):
+                    region_changes[region].append(record)
+                    break
 
-    s3_uploads = {}
+    s3_uploads, region_records = {}, {}
 
     # save raw data in Amazon S3, one file per region
     for region in TARGET_REGIONS:
 
-        price_list = download_spotprice_data([region])
+        quarantine = open_quarantine([region], start, end)
+        price_list = download_spotprice_data([region], quarantine=quarantine)
+        upload_quarantine(quarantine, BUCKET)
+        region_records[region] = len(price_list)
 
-        fname = '_'.join(
-                    [
-                        start.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                        end.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                        'all-instance-spot-prices.json'
-                    ]
-                )
+        fname = archive_filename(start, end)
 
         # write to file on local filesystem
         key = os.path.join(region, fname)
-        _completed = s3upload(BUCKET, {'SpotPriceHistory': price_list}, key)
+        _completed = upload_archive(BUCKET, price_list, key)
         s3_uploads[region] = str(_completed)
         logger.info('Completed upload to Amazon S3 for region {}'.format(region))
 
@@ -469,4 +639,32 @@ def lambda_handler(event, context):
         failure = f'Problem writing {fkey} to local filesystem'
         logger.info(success) if _completed else logger.warning(failure)
 
-    return summary_report(s3_uploads, prices1, prices2, prices3, prices4)
+        # change feed archive, one file per region
+        if source_environment('change_feed'):
+            ckey = os.path.join('changefeed', region, archive_filename(start, end, 'spot-price-changes.json'))
+            _completed = s3upload(BUCKET, {'SpotPriceChanges': region_changes[region]}, ckey)
+            s3_uploads['changefeed/' + region] = str(_completed)
+
+    # spool retained for replay while records remain uncommitted
+    if spool is not None and not load_status['remaining'] and not load_status['failed']:
+        spool.remove()
+
+    result = dict(
+        load_status,
+        regions=TARGET_REGIONS,
+        records=records,
+        region_records=region_records,
+        uploads=s3_uploads,
+        duration=round(time.monotonic() - started, 1)
+    )
+    logger.info('<-- SPOTPRICE RETRIEVER VERSION {} END -->'.format(__version__))
+    # orchestrator shards are published once, merged, by the orchestrator
+    shard = str((event.get('detail') or {}).get('eventName', '')).startswith('OrchestratorShard')
+    result['report'] = report([result], 'SpotPrice data load summary', notify=not shard).get('published', False)
+
+    # asynchronous orchestrator shard: result collected from S3 by orchestrator.reduce_handler
+    if event.get('orchestrator'):
+        result['finished'] = time.time()
+        s3upload(event['orchestrator']['bucket'], result, event['orchestrator']['result_key'])
+    loggers.flush()
+    return result
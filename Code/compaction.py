@@ -0,0 +1,359 @@
+"""
+
+compaction (python3)
+
+    Monthly compaction of daily region archives in Amazon S3.
+
+    The loader writes one archive per region per run, so small regions
+    accumulate thousands of tiny objects.  compact_month() merges the
+    daily archives of one region and month (indexed or legacy format)
+    into a single gzip compressed, day-chunked indexed archive:
+
+        <region>/compacted/<YYYY-MM>/spot-prices-<token>.jsonl.gz (+ .idx)
+
+    The month is processed one day at a time, so memory holds a single
+    day of records:  the source indexes are read first, then for each day
+    the matching chunks of every source are fetched with ranged GETs,
+    de-duplicated, encoded and streamed into a multipart upload.  Legacy
+    sources without an index are read once and spilled to per-day files
+    in the temporary directory.
+
+    Record counts are verified against each source index and against
+    every encoded day before the upload completes.  The per region
+    manifest, <region>/compacted/manifest.json, is then replaced with a
+    single PUT, which swaps in the new object atomically for readers.
+    Only after the swap are the daily sources and any superseded
+    compacted object deleted.  Re-running a month merges late arriving
+    daily archives with the existing compacted object.
+
+    Lambda handler:  compaction.lambda_handler
+    Command line:    python3 compaction.py --bucket <bucket> --month 2020-01
+
+"""
+import os
+import sys
+import shutil
+import argparse
+import datetime
+import tempfile
+import boto3
+from botocore.exceptions import ClientError
+from pyaws.awslambda import read_env_variable
+from archives import INDEX_SUFFIX, build_archive, decode_chunk, index_chunks, period_label, period_number, read_archive
+from timestamps import to_epoch
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+COMPACTED_PREFIX = 'compacted'
+MANIFEST = 'manifest.json'
+
+# S3 multipart minimum part size is 5 MB
+PART_SIZE = 8 * 1024 * 1024
+
+
+class CompactionError(Exception):
+    """Source or compacted archive failed verification"""
+
+
+def manifest_key(region):
+    return '/'.join([region, COMPACTED_PREFIX, MANIFEST])
+
+
+def compacted_key(region, month, token):
+    return '/'.join([region, COMPACTED_PREFIX, month, 'spot-prices-{}.jsonl.gz'.format(token)])
+
+
+def previous_month(today=None):
+    """Month label (YYYY-MM) of the last complete month"""
+    first = (today or datetime.date.today()).replace(day=1)
+    return (first - datetime.timedelta(days=1)).strftime('%Y-%m')
+
+
+def daily_archives(s3client, bucket, region, month):
+    """Keys of daily archive objects of a region whose window starts in month"""
+    keys = []
+    paginator = s3client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix='{}/{}'.format(region, month)):
+        keys.extend(x['Key'] for x in page.get('Contents', []) if not x['Key'].endswith(INDEX_SUFFIX))
+    return sorted(keys)
+
+
+def load_manifest(s3client, bucket, region):
+    try:
+        body = s3client.get_object(Bucket=bucket, Key=manifest_key(region))['Body'].read()
+        return serializers.loads(body)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+    return {'region': region, 'months': {}}
+
+
+class DaySpill():
+    """
+        Per-day newline delimited json files holding the records of
+        legacy (unindexed) sources until their day is compacted
+    """
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='compaction-')
+        self.files = {}
+
+    def add(self, day, record):
+        f1 = self.files.get(day)
+        if f1 is None:
+            f1 = self.files[day] = open(os.path.join(self.path, day + '.jsonl'), 'wb')
+        f1.write(serializers.dumps(record) + b'\n')
+
+    def days(self):
+        return set(self.files)
+
+    def read(self, day):
+        if day not in self.files:
+            return []
+        self.files[day].close()
+        with open(os.path.join(self.path, day + '.jsonl'), 'rb') as f1:
+            return decode_chunk(f1.read())
+
+    def remove(self):
+        for f1 in self.files.values():
+            f1.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _source_plan(s3client, bucket, key, spill):
+    """
+    Summary.
+
+        Reads the index of a source archive.  Legacy sources have no index:
+        they are read once and their records spilled by day
+
+    Returns:
+        (day label --> index chunks, source record count), TYPE: tuple
+
+    """
+    try:
+        index = serializers.loads(s3client.get_object(Bucket=bucket, Key=key + INDEX_SUFFIX)['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        records = read_archive(s3client.get_object(Bucket=bucket, Key=key)['Body'].read())
+        for record in records:
+            spill.add(period_label(to_epoch(record['Timestamp']) // 86400, 'day'), record)
+        return {}, len(records)
+
+    plan = {}
+    chunks = index_chunks(index)
+    if sum(x[5] for x in chunks) != index['records']:
+        raise CompactionError('{}: index chunks list {} records of {}'.format(
+            key, sum(x[5] for x in chunks), index['records']))
+    for chunk in chunks:
+        plan.setdefault(chunk[2][:10], []).append(chunk)
+    return plan, index['records']
+
+
+def _read_day(s3client, bucket, key, chunks):
+    """Decodes the chunks of one day of a source with a single ranged GET"""
+    start = min(x[3] for x in chunks)
+    end = max(x[3] + x[4] for x in chunks)
+    data = s3client.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end - 1))['Body'].read()
+
+    records = []
+    for itype, az, label, offset, length, count in chunks:
+        decoded = decode_chunk(data[offset - start:offset - start + length])
+        if len(decoded) != count:
+            raise CompactionError('{}: chunk {} {} {} lists {} records, decoded {}'.format(
+                key, itype, az, label, count, len(decoded)))
+        records.extend(decoded)
+    return records
+
+
+def _upload_part(s3client, bucket, key, upload_id, parts, body):
+    number = len(parts) + 1
+    response = s3client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=bytes(body))
+    parts.append({'PartNumber': number, 'ETag': response['ETag']})
+
+
+def _record_key(record):
+    return (
+        to_epoch(record['Timestamp']),
+        record['AvailabilityZone'],
+        record['InstanceType'],
+        record['ProductDescription']
+    )
+
+
+def _delete(s3client, bucket, keys):
+    for index in range(0, len(keys), 1000):
+        s3client.delete_objects(
+            Bucket=bucket,
+            Delete={'Objects': [{'Key': x} for x in keys[index:index + 1000]], 'Quiet': True}
+        )
+
+
+def compact_month(bucket, region, month, delete_sources=True):
+    """
+    Summary.
+
+        Merges the daily archives of one region and month into a single
+        compressed archive and publishes it in the region manifest
+
+    Args:
+        :bucket (str):  archive bucket
+        :region (str):  AWS region code
+        :month (str):  month label, format 2020-01
+        :delete_sources (bool):  delete daily archives once the manifest
+            references the compacted object
+
+    Returns:
+        manifest entry of the month, TYPE: dict; None when there was
+        nothing to compact or verification failed
+
+    """
+    s3client = boto3.client('s3')
+    spill, upload_id = DaySpill(), None
+
+    try:
+        manifest = load_manifest(s3client, bucket, region)
+        previous = manifest['months'].get(month)
+        daily = daily_archives(s3client, bucket, region, month)
+
+        if not daily:
+            logger.info('{} {}: no daily archives to compact'.format(region, month))
+            return previous
+
+        sources = ([previous['key']] if previous else []) + daily
+        plans, source_records = [], 0
+        for source in sources:
+            plan, count = _source_plan(s3client, bucket, source, spill)
+            plans.append((source, plan))
+            source_records += count
+
+        days = sorted(set(x for _, plan in plans for x in plan) | spill.days())
+        if not days:
+            logger.info('{} {}: daily archives hold no records'.format(region, month))
+            return previous
+
+        key = compacted_key(region, month, datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ'))
+        upload_id = s3client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+        parts, buffer, size, records, series, first = [], bytearray(), 0, 0, [], None
+
+        for day in days:
+            # one day in memory; a record key always falls in one day
+            day_records, seen = [], set()
+            day_sources = [_read_day(s3client, bucket, x, plan[day]) for x, plan in plans if day in plan]
+            for record in [x for source in day_sources for x in source] + spill.read(day):
+                rkey = _record_key(record)
+                if rkey not in seen:
+                    seen.add(rkey)
+                    day_records.append(record)
+            del day_sources, seen
+
+            body, index = build_archive(day_records, period='day', compress=True)
+            if len(decode_chunk(body)) != len(day_records):
+                raise CompactionError('{} {}: compacted day {} failed verification'.format(region, month, day))
+
+            number = period_number(index['start'], 'day')
+            first = number if first is None else first
+            for itype, az, offset, periods in index['series']:
+                series.append([itype, az, size + offset, [[number - first + x[0], x[1], x[2]] for x in periods]])
+
+            size += len(body)
+            records += len(day_records)
+            buffer += body
+            if len(buffer) >= PART_SIZE:
+                _upload_part(s3client, bucket, key, upload_id, parts, buffer)
+                buffer = bytearray()
+
+        if buffer:
+            _upload_part(s3client, bucket, key, upload_id, parts, buffer)
+        s3client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+        upload_id = None
+
+        index = {'records': records, 'period': 'day', 'start': period_label(first, 'day'), 'series': series}
+        s3client.put_object(Bucket=bucket, Key=key + INDEX_SUFFIX, Body=serializers.dumps(index))
+
+        if s3client.head_object(Bucket=bucket, Key=key)['ContentLength'] != size:
+            logger.error('{}: uploaded size differs from compacted archive'.format(key))
+            _delete(s3client, bucket, [key, key + INDEX_SUFFIX])
+            return None
+
+        entry = {
+            'key': key,
+            'records': records,
+            'source_records': source_records,
+            'sources': len(sources),
+            'bytes': size,
+            'compacted': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+        manifest['months'][month] = entry
+        s3client.put_object(Bucket=bucket, Key=manifest_key(region), Body=serializers.dumps(manifest, pretty=True))
+
+        # retire objects only after the manifest swap
+        obsolete = []
+        if previous and previous['key'] != key:
+            obsolete.extend([previous['key'], previous['key'] + INDEX_SUFFIX])
+        if delete_sources:
+            obsolete.extend(daily + [x + INDEX_SUFFIX for x in daily])
+        _delete(s3client, bucket, obsolete)
+
+    except CompactionError as e:
+        logger.error('{}; {} {} not compacted'.format(e, region, month))
+        return None
+
+    except ClientError as e:
+        logger.exception('Problem compacting {} {}: {}'.format(region, month, e))
+        return None
+
+    finally:
+        if upload_id is not None:
+            try:
+                s3client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except ClientError as e:
+                logger.exception('Problem aborting multipart upload of {}: {}'.format(key, e))
+        spill.remove()
+
+    logger.info('{} {}: compacted {} objects ({} records, {} duplicates) into {} ({} bytes)'.format(
+        region, month, len(sources), records, source_records - records, key, size))
+    return entry
+
+
+def lambda_handler(event, context):
+    """
+    Compact the daily archives of TARGET_REGIONS for the last complete
+    month, or the month given in the event ({"month": "2020-01"})
+    """
+    BUCKET = read_env_variable('S3_BUCKET')
+    DELETE_SOURCES = read_env_variable('COMPACTION_DELETE', 'True') in ('true', 'True')
+
+    try:
+        TARGET_REGIONS = event['detail']['responseElements'].split(',')
+    except (KeyError, TypeError):
+        TARGET_REGIONS = read_env_variable('TARGET_REGIONS').split(',')
+
+    month = (event or {}).get('month') or previous_month()
+    status = {x: compact_month(BUCKET, x, month, DELETE_SOURCES) for x in TARGET_REGIONS}
+    loggers.flush()
+    return {'month': month, 'regions': status}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact daily spot price archives into monthly objects')
+    parser.add_argument('--bucket', required=True, help='archive bucket')
+    parser.add_argument('--regions', default=read_env_variable('TARGET_REGIONS'), help='comma separated region codes')
+    parser.add_argument('--month', default=previous_month(), help='month to compact, format 2020-01')
+    parser.add_argument('--keep-sources', action='store_true', help='do not delete daily archives')
+    args = parser.parse_args()
+
+    if not args.regions:
+        parser.error('--regions or TARGET_REGIONS required')
+
+    for region in args.regions.split(','):
+        compact_month(args.bucket, region, args.month, not args.keep_sources)
+    loggers.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
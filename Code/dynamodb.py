@@ -8,26 +8,14 @@ from multiprocessing.dummy import Pool
 from botocore.exceptions import ClientError
 from pyaws.awslambda import read_env_variable
 from libtools.js import export_iterobject
-from spotlib import SpotPrices, UtcConversion
+from spotlib import SpotPrices
+from timestamps import standardize_datetime, utc_datetime, datetimify_standard
 import loggers
 from _version import __version__
 
 logger = loggers.getLogger(__version__)
 
 
-def standardize_datetime(dt):
-    return dt.strftime('%Y-%m-%d %H:%M:%S')
-
-
-def utc_datetime(dt):
-    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-
-def datetimify_standard(s):
-    """Function to create timezone unaware string"""
-    return datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
-
-
 @lru_cache()
 def get_data(partition_key, value, tableName, region=None):
     """
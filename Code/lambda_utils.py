@@ -21,11 +21,11 @@ License:
 
 import os
 import re
-import json
 import time
 import inspect
 import boto3
 from botocore.exceptions import ClientError
+import serializers
 import loggers
 from _version import __version__
 
@@ -132,7 +132,7 @@ def sns_notification(topic_arn, subject, message, account_id=None, account_name=
         response = client.publish(
             TopicArn=topic_arn,
             Subject=header,
-            Message=json.dumps(msg_dict),
+            Message=serializers.dumps(msg_dict).decode('utf-8'),
             MessageStructure='json'
         )
         if str(response['ResponseMetadata']['HTTPStatusCode']).startswith('20'):
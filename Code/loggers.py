@@ -4,11 +4,94 @@ Example usage:
 >>> __version__ = '1.2.3' # Or wherever the version is stored
 >>> logger = _getLogger(__version__)
 >>> logger.warn('omg what is happening')
-<doctest autotag.loggers[2]> - 1.2.3 - [WARNING]: omg what is happening
+{"time": "2020-06-01T00:00:00", "level": "WARNING", "version": "1.2.3", "module": "loggers", "message": "omg what is happening"}
+
+Records are handed to a QueueHandler; a single QueueListener thread
+formats and writes them to stdout, so worker threads never block on the
+stream.  Environment variables:
+
+    LOG_LEVEL       minimum level emitted (default INFO)
+    LOG_FORMAT      'json' (default) or 'text'
+    LOG_SAMPLE      warnings / errors from one call site logged in full
+                    before sampling begins (default 10)
+    LOG_SAMPLE_RATE after LOG_SAMPLE, log 1 in N from that call site (default 100)
 """
+import os
+import sys
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from _version import __version__
-import sys
+
+_queue = queue.Queue(-1)
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as single line json documents"""
+    def format(self, record):
+        document = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'version': record.name,
+            'module': record.module,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'fields', None):
+            document.update(record.fields)
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class ErrorSampler(logging.Filter):
+    """
+        Passes the first `first` warnings or errors logged from each call
+        site, then one in `rate`, annotated with the number suppressed
+    """
+    def __init__(self, first=10, rate=100):
+        super(ErrorSampler, self).__init__()
+        self.first = first
+        self.rate = rate
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        site = (record.pathname, record.lineno)
+        with self.lock:
+            count = self.counts[site] = self.counts.get(site, 0) + 1
+        if count <= self.first:
+            return True
+        if (count - self.first) % self.rate:
+            return False
+        record.msg = '{} [sampled: {} similar messages suppressed]'.format(record.msg, self.rate - 1)
+        return True
+
+
+def _listen():
+    """Starts the queue listener writing formatted records to stdout"""
+    global _listener
+    handler = logging.StreamHandler(sys.stdout)
+    if os.environ.get('LOG_FORMAT', 'json') == 'text':
+        handler.setFormatter(logging.Formatter('%(module)s - %(name)s - [%(levelname)s]: %(message)s'))
+    else:
+        handler.setFormatter(JsonFormatter())
+    _listener = QueueListener(_queue, handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def flush():
+    """Blocks until queued records are written; call before a handler returns"""
+    if _listener is not None:
+        _queue.join()
+        sys.stdout.flush()
 
 
 def _getLogger(*args, **kwargs):
@@ -16,12 +99,76 @@ def _getLogger(*args, **kwargs):
     logger = logging.getLogger(*args, **kwargs)
     logger.propagate = False
     if not logger.handlers:
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(logging.Formatter('%(pathname)s - %(name)s - [%(levelname)s]: %(message)s'))
+        if _listener is None:
+            _listen()
+        handler = QueueHandler(_queue)
+        handler.addFilter(ErrorSampler(
+            first=int(os.environ.get('LOG_SAMPLE', 10)),
+            rate=int(os.environ.get('LOG_SAMPLE_RATE', 100))
+        ))
         logger.addHandler(handler)
-        logger.setLevel(logging.DEBUG)
+        logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
     return logger
 
 
 def getLogger(*a, **kv):
     return _getLogger(__version__)
+
+
+class ProgressLogger():
+    """
+        Aggregated progress reporting for a pipeline stage.  Emits one
+        line every `every` records or `interval` seconds, whichever comes
+        first, in place of one line per record.  Thread safe
+
+    Args:
+        :logger (logging.Logger):  destination logger
+        :stage (str):  pipeline stage name, e.g. 'dynamodb'
+        :total (int):  records expected, if known
+        :every (int):  record count between progress lines
+        :interval (int):  seconds between progress lines
+
+    """
+    def __init__(self, logger, stage, total=None, every=10000, interval=30):
+        self.logger = logger
+        self.stage = stage
+        self.total = total
+        self.every = every
+        self.interval = interval
+        self.count = 0
+        self.errors = 0
+        self.started = self.last = time.monotonic()
+        self.last_count = 0
+        self.lock = threading.Lock()
+
+    def _emit(self, now, final=False):
+        elapsed = max(now - self.started, 1e-6)
+        fields = {
+            'stage': self.stage,
+            'records': self.count,
+            'errors': self.errors,
+            'rate': round(self.count / elapsed, 1),
+            'elapsed': round(elapsed, 1)
+        }
+        if self.total is not None:
+            fields['total'] = self.total
+        self.logger.info(
+            '{} {}: {} records{}, {} errors, {}/s'.format(
+                self.stage, 'complete' if final else 'progress', self.count,
+                ' of {}'.format(self.total) if self.total is not None else '',
+                self.errors, fields['rate']),
+            extra={'fields': fields}
+        )
+        self.last, self.last_count = now, self.count
+
+    def update(self, n=1, errors=0):
+        with self.lock:
+            self.count += n
+            self.errors += errors
+            now = time.monotonic()
+            if self.count - self.last_count >= self.every or now - self.last >= self.interval:
+                self._emit(now)
+
+    def close(self):
+        with self.lock:
+            self._emit(time.monotonic(), final=True)
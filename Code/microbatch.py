@@ -0,0 +1,190 @@
+"""
+
+microbatch (python3)
+
+    Near real-time micro-batch ingestion mode.
+
+    Invoked every few minutes, each run retrieves a short sliding window
+    of spot price history which overlaps the previous window, so no price
+    change is missed between runs.  Records in the overlap were already
+    loaded by the previous run; OverlapDeduplicator drops them in memory
+    (state persists across warm invocations) before loading, keeping
+    per-invocation work small and steady instead of one daily burst.
+    Keys are remembered only once their batch is committed to DynamoDB,
+    so records failed or cut off by the deadline are retried by the next
+    overlapping window.
+
+        MICROBATCH_WINDOW   minutes of new data per run (default 5)
+        MICROBATCH_OVERLAP  minutes re-read from the previous window (default 5)
+        MICROBATCH_WORKERS  DynamoDB loader threads (default 2)
+
+    Lambda handler:  microbatch.lambda_handler
+
+"""
+import time
+import datetime
+import threading
+from pyaws.awslambda import read_env_variable
+from changefeed import save_state, series_key
+from ondemand import get_catalog
+from scheduler import partition_schedule
+from cli import (DynamoDBPrices, change_detector, download_spotprice_data, join_workers, open_quarantine,
+                 source_environment, upload_quarantine)
+from timestamps import to_epoch
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+
+def sliding_window(now, window_minutes=5, overlap_minutes=5):
+    """
+    Summary.
+
+        Retrieval window ending at the current minute
+
+    Returns:
+        start, end datetimes, TYPE: tuple
+
+    """
+    end = now.replace(second=0, microsecond=0)
+    start = end - datetime.timedelta(minutes=window_minutes + overlap_minutes)
+    return start, end
+
+
+class OverlapDeduplicator():
+    """
+        Remembers the (series, timestamp) keys committed within the last
+        `horizon` seconds and filters them from subsequent windows
+
+    Args:
+        :horizon (int):  seconds of history retained before the window
+            start; at least the window overlap
+
+    """
+    def __init__(self, horizon):
+        self.horizon = horizon
+        self.seen = {}          # epoch timestamp --> set of series keys
+        self.warm = False
+
+    def __len__(self):
+        return sum(len(x) for x in self.seen.values())
+
+    def filter(self, records, start):
+        """
+        Summary.
+
+            Drops records already committed by a previous window, and
+            duplicates within the current window.  Nothing is remembered
+            until commit()
+
+        Args:
+            :records (list):  spot price dictionaries of the current window
+            :start (datetime):  window start.  EC2 also returns the price in
+                effect at the window start, stamped with its (older) change
+                time; once warm, records older than start - horizon were
+                loaded by an earlier window and are dropped
+
+        Returns:
+            records not seen before, TYPE: list
+
+        """
+        floor = to_epoch(start) - self.horizon
+        for ts in [x for x in self.seen if x < floor]:
+            del self.seen[ts]
+
+        fresh, window = [], set()
+        for record in records:
+            ts = to_epoch(record['Timestamp'])
+            if self.warm and ts < floor:
+                continue
+            key = (ts, series_key(record))
+            if key not in window and key[1] not in self.seen.get(ts, ()):
+                window.add(key)
+                fresh.append(record)
+        return fresh
+
+    def commit(self, records):
+        """Remembers records written to the table, TYPE: int (count)"""
+        count = 0
+        for record in records:
+            self.seen.setdefault(to_epoch(record['Timestamp']), set()).add(series_key(record))
+            count += 1
+        if count:
+            self.warm = True
+        return count
+
+
+deduplicator = None     # persists across warm invocations
+
+
+def lambda_handler(event, context):
+    """
+    Load one micro-batch window of spot prices for TARGET_REGIONS
+    """
+    global deduplicator
+    started = time.monotonic()
+
+    REGION = read_env_variable('DEFAULT_REGION', 'us-east-2')
+    TABLE = read_env_variable('DYNAMODB_TABLE', 'PriceData')
+    WINDOW = int(read_env_variable('MICROBATCH_WINDOW', 5))
+    OVERLAP = int(read_env_variable('MICROBATCH_OVERLAP', 5))
+    WORKERS = int(read_env_variable('MICROBATCH_WORKERS', 2))
+
+    try:
+        TARGET_REGIONS = event['detail']['responseElements'].split(',')
+    except (KeyError, TypeError):
+        TARGET_REGIONS = read_env_variable('TARGET_REGIONS').split(',')
+
+    if deduplicator is None:
+        deduplicator = OverlapDeduplicator(horizon=(WINDOW + OVERLAP) * 60)
+
+    start, end = sliding_window(datetime.datetime.utcnow(), WINDOW, OVERLAP)
+    quarantine = open_quarantine(TARGET_REGIONS, start, end)
+    price_list = download_spotprice_data(TARGET_REGIONS, start_dt=start, end_dt=end, quarantine=quarantine)
+    upload_quarantine(quarantine, read_env_variable('S3_BUCKET'))
+    retrieved = len(price_list)
+    price_list = deduplicator.filter(price_list, start)
+
+    if source_environment('change_feed'):
+        detector = change_detector(TARGET_REGIONS, read_env_variable('S3_BUCKET'))
+        price_list = detector.detect(price_list)
+
+    logger.info('Micro-batch {} - {}: {} retrieved, {} new records'.format(
+        start.isoformat(), end.isoformat(), retrieved, len(price_list)))
+
+    stop_event = threading.Event()
+    progress = loggers.ProgressLogger(logger, 'dynamodb', total=len(price_list))
+    ondemand = get_catalog(read_env_variable('S3_BUCKET'))
+    workers = [
+        DynamoDBPrices(
+            region=REGION,
+            table_name=TABLE,
+            price_dicts=x,
+            start_date=start,
+            end_date=end,
+            stop_event=stop_event,
+            progress=progress,
+            ondemand=ondemand
+        ) for x in [[price_list[i] for i in y] for y in partition_schedule(price_list, WORKERS)] if x
+    ]
+    for worker in workers:
+        worker.start()
+
+    load_status = join_workers(workers, context, reserve=5)
+    progress.close()
+
+    # only committed records are skipped by later windows, or move detector state
+    committed = [x for worker in workers for x in worker.committed_records()]
+    deduplicator.commit(committed)
+    if source_environment('change_feed'):
+        detector.commit(committed)
+        save_state(detector, read_env_variable('S3_BUCKET'), TARGET_REGIONS)
+    loggers.flush()
+    return dict(
+        load_status,
+        regions=TARGET_REGIONS,
+        retrieved=retrieved,
+        records=len(price_list),
+        duration=round(time.monotonic() - started, 1)
+    )
@@ -0,0 +1,317 @@
+"""
+
+ondemand (python3)
+
+    Indexed EC2 on-demand price catalog used to enrich spot price records.
+
+    The EC2 bulk pricing offer files (one per region) are reduced to a
+    compact lookup index keyed by (region, InstanceType,
+    ProductDescription) holding the hourly USD on-demand price.  Offers
+    are streamed in their csv form one row at a time, keeping only the
+    rows indexed, so memory stays flat regardless of offer size.  The
+    index is snapshotted to Amazon S3, cached in memory and /tmp across
+    warm invocations (revalidated against the snapshot ETag), and
+    refreshed incrementally:  only regions whose offer version changed in
+    the region index are re-downloaded.
+
+    Offer files may be staged locally (e.g. for tests) and loaded with
+    OnDemandCatalog.add_offer(serializers.load_file(path), region).
+
+    Lambda handler (index refresh):  ondemand.lambda_handler
+
+"""
+import os
+import io
+import csv
+import urllib.request
+from decimal import Decimal
+import boto3
+from botocore.exceptions import ClientError
+from pyaws.awslambda import read_env_variable
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+PRICING_ENDPOINT = 'https://pricing.us-east-1.amazonaws.com'
+REGION_INDEX = '/offers/v1.0/aws/AmazonEC2/current/region_index.json'
+CATALOG_PATH = '/tmp/ondemand-index.json'
+CATALOG_KEY = 'catalog/ondemand-index.json'
+FETCH_TIMEOUT = 60      # seconds, per blocking socket operation
+
+# spot ProductDescription --> offer file operatingSystem attribute
+OPERATING_SYSTEMS = {
+    'Linux/UNIX': 'Linux',
+    'Linux/UNIX (Amazon VPC)': 'Linux',
+    'SUSE Linux': 'SUSE',
+    'SUSE Linux (Amazon VPC)': 'SUSE',
+    'Red Hat Enterprise Linux': 'RHEL',
+    'Red Hat Enterprise Linux (Amazon VPC)': 'RHEL',
+    'Windows': 'Windows',
+    'Windows (Amazon VPC)': 'Windows'
+}
+
+
+def _price(dimensions):
+    """Hourly USD price of an on-demand term; None when zero or absent"""
+    for dimension in dimensions.values():
+        usd = dimension.get('pricePerUnit', {}).get('USD')
+        if usd and dimension.get('unit') == 'Hrs' and Decimal(usd) > 0:
+            return '{:f}'.format(Decimal(usd).normalize())
+    return None
+
+
+def _indexed(attributes):
+    """True for shared tenancy instances without pre-installed software"""
+    return (attributes.get('tenancy') == 'Shared'
+            and attributes.get('preInstalledSw', 'NA') == 'NA'
+            and attributes.get('capacitystatus', 'Used') == 'Used'
+            and attributes.get('licenseModel', 'No License required') == 'No License required'
+            and bool(attributes.get('instanceType')) and bool(attributes.get('operatingSystem')))
+
+
+def index_offer(offer):
+    """
+    Summary.
+
+        Reduces one region's EC2 offer file to on-demand prices of shared
+        tenancy instances without pre-installed software
+
+    Args:
+        :offer (dict):  parsed EC2 bulk pricing offer file
+
+    Returns:
+        operatingSystem --> {InstanceType: price}, TYPE: dict
+
+    """
+    skus = {}
+    for sku, product in offer.get('products', {}).items():
+        attributes = product.get('attributes', {})
+        if _indexed(attributes):
+            skus[sku] = (attributes['operatingSystem'], attributes['instanceType'])
+
+    prices = {}
+    for sku, terms in offer.get('terms', {}).get('OnDemand', {}).items():
+        if sku not in skus:
+            continue
+        for term in terms.values():
+            price = _price(term.get('priceDimensions', {}))
+            if price is not None:
+                operating_system, instance_type = skus[sku]
+                prices.setdefault(operating_system, {})[instance_type] = price
+    return prices
+
+
+# offer csv column --> offer json product attribute
+CSV_ATTRIBUTES = {
+    'Tenancy': 'tenancy',
+    'Pre Installed S/W': 'preInstalledSw',
+    'CapacityStatus': 'capacitystatus',
+    'License Model': 'licenseModel',
+    'Instance Type': 'instanceType',
+    'Operating System': 'operatingSystem'
+}
+
+
+def index_offer_csv(lines):
+    """
+    Summary.
+
+        Streaming equivalent of index_offer for the csv form of an offer
+        file.  Rows are read one at a time; only OnDemand hourly USD rows
+        of indexed products are kept
+
+    Args:
+        :lines (iterable):  text lines of the offer csv, including the
+            metadata lines preceding the column header
+
+    Returns:
+        operatingSystem --> {InstanceType: price}, TYPE: dict
+
+    """
+    rows = csv.reader(lines)
+    for header in rows:
+        if header and header[0] == 'SKU':
+            break
+    else:
+        return {}
+
+    column = {name: i for i, name in enumerate(header)}
+    term, unit, usd, currency = (column[x] for x in ('TermType', 'Unit', 'PricePerUnit', 'Currency'))
+    attributes = [(column[k], v) for k, v in CSV_ATTRIBUTES.items() if k in column]
+
+    prices = {}
+    for row in rows:
+        if len(row) != len(header) or row[term] != 'OnDemand' or row[unit] != 'Hrs' or row[currency] != 'USD':
+            continue
+        product = {name: row[i] for i, name in attributes}
+        if not _indexed(product):
+            continue
+        price = _price({'': {'unit': 'Hrs', 'pricePerUnit': {'USD': row[usd]}}})
+        if price is not None:
+            prices.setdefault(product['operatingSystem'], {})[product['instanceType']] = price
+    return prices
+
+
+class OnDemandCatalog():
+    """
+        (region, InstanceType, ProductDescription) --> on-demand price
+    """
+    def __init__(self):
+        self.prices = {}
+        self.versions = {}      # region --> offer version url
+
+    def __len__(self):
+        return len(self.prices)
+
+    def lookup(self, region, instance_type, product_description):
+        return self.prices.get((region, instance_type, product_description))
+
+    def add_offer(self, offer, region, version=None):
+        """Replaces the prices of one region with those of an offer file"""
+        self.add_prices(index_offer(offer), region, version or offer.get('version'))
+
+    def add_prices(self, by_os, region, version):
+        """Replaces the prices of one region with an indexed offer"""
+        self.prices = {k: v for k, v in self.prices.items() if k[0] != region}
+        for product_description, operating_system in OPERATING_SYSTEMS.items():
+            for instance_type, price in by_os.get(operating_system, {}).items():
+                self.prices[(region, instance_type, product_description)] = price
+        self.versions[region] = version
+
+    def refresh(self, regions, endpoint=PRICING_ENDPOINT, timeout=FETCH_TIMEOUT):
+        """
+        Summary.
+
+            Streams the csv offer files of regions whose published
+            version differs from the indexed version
+
+        Returns:
+            regions refreshed, TYPE: list
+
+        """
+        region_index = serializers.loads(_fetch(endpoint + REGION_INDEX, timeout))['regions']
+        refreshed = []
+
+        for region in regions:
+            url = region_index.get(region, {}).get('currentVersionUrl')
+            if url is None or self.versions.get(region) == url:
+                continue
+            logger.info('Refreshing on-demand prices for region {}'.format(region))
+            with urllib.request.urlopen(endpoint + os.path.splitext(url)[0] + '.csv', timeout=timeout) as response:
+                by_os = index_offer_csv(io.TextIOWrapper(response, encoding='utf-8', newline=''))
+            if not by_os:
+                logger.warning('No on-demand prices in offer {}; region {} not refreshed'.format(url, region))
+                continue
+            self.add_prices(by_os, region, url)
+            refreshed.append(region)
+        return refreshed
+
+    def dumps(self):
+        return serializers.dumps({
+            'versions': self.versions,
+            'prices': {'|'.join(k): v for k, v in self.prices.items()}
+        })
+
+    @classmethod
+    def loads(cls, data):
+        document = serializers.loads(data)
+        catalog = cls()
+        catalog.versions = document['versions']
+        catalog.prices = {tuple(k.split('|')): v for k, v in document['prices'].items()}
+        return catalog
+
+
+def _fetch(url, timeout=FETCH_TIMEOUT):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+_catalog = None     # persists across warm invocations
+_etag = None        # ETag of the S3 snapshot _catalog was loaded from
+
+
+def _snapshot_etag(bucket):
+    """ETag of the S3 index snapshot; None when unavailable"""
+    try:
+        return boto3.client('s3').head_object(Bucket=bucket, Key=CATALOG_KEY)['ETag']
+    except ClientError as e:
+        logger.warning('On-demand price index snapshot unavailable: {}'.format(e))
+        return None
+
+
+def _cache(body, etag, path):
+    """Writes the index and the ETag it was read with to /tmp"""
+    with open(path, 'wb') as f1:
+        f1.write(body)
+    with open(path + '.etag', 'w') as f2:
+        f2.write(etag or '')
+
+
+def _cached_etag(path):
+    try:
+        with open(path + '.etag') as f1:
+            return f1.read() or None
+    except OSError:
+        return None
+
+
+def get_catalog(bucket=None, path=CATALOG_PATH):
+    """
+    Summary.
+
+        Returns the on-demand catalog from memory, the /tmp index file or
+        the S3 snapshot, in that order.  With a bucket, the ETag of the
+        snapshot is checked on every call:  cached copies are reused only
+        while they match, so warm containers pick up a refreshed index
+
+    Returns:
+        OnDemandCatalog, empty when no index is available
+
+    """
+    global _catalog, _etag
+
+    etag = _snapshot_etag(bucket) if bucket else None
+
+    if _catalog is not None and (etag is None or etag == _etag):
+        return _catalog
+
+    if os.path.exists(path) and (etag is None or etag == _cached_etag(path)):
+        with open(path, 'rb') as f1:
+            _catalog, _etag = OnDemandCatalog.loads(f1.read()), _cached_etag(path)
+    elif etag is not None:
+        try:
+            response = boto3.client('s3').get_object(Bucket=bucket, Key=CATALOG_KEY)
+            body = response['Body'].read()
+            _cache(body, response['ETag'], path)
+            _catalog, _etag = OnDemandCatalog.loads(body), response['ETag']
+        except ClientError as e:
+            logger.warning('On-demand price index unavailable: {}'.format(e))
+            _catalog = _catalog or OnDemandCatalog()
+    else:
+        _catalog = OnDemandCatalog()
+
+    logger.info('On-demand price index loaded with {} prices'.format(len(_catalog)))
+    return _catalog
+
+
+def lambda_handler(event, context):
+    """
+    Incrementally refresh the on-demand price index snapshot in Amazon S3
+    """
+    BUCKET = read_env_variable('S3_BUCKET')
+    TARGET_REGIONS = read_env_variable('TARGET_REGIONS').split(',')
+
+    global _etag
+
+    catalog = get_catalog(BUCKET)
+    refreshed = catalog.refresh(TARGET_REGIONS)
+
+    if refreshed:
+        body = catalog.dumps()
+        _etag = boto3.client('s3').put_object(Bucket=BUCKET, Key=CATALOG_KEY, Body=body)['ETag']
+        _cache(body, _etag, CATALOG_PATH)
+    logger.info('On-demand price index: {} prices, refreshed regions: {}'.format(len(catalog), refreshed))
+    loggers.flush()
+    return {'prices': len(catalog), 'refreshed': refreshed}
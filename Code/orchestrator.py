@@ -0,0 +1,337 @@
+"""
+
+orchestrator (python3)
+
+    Map-reduce entry point for full fleet spot price loads.
+
+    TARGET_REGIONS are split into balanced shards (largest region first
+    into the lightest shard, weighted by archive volume), each shard is
+    dispatched to a worker through a pluggable executor, and per-shard
+    statistics written by the loader (cli.lambda_handler) to S3 are
+    merged into one digest (reporting.build_digest).  Executors share one
+    interface, dispatch(events), returning a dispatch error (or None) per
+    shard:
+
+        - LocalExecutor:   ProcessPoolExecutor, one worker process per
+                           shard; returns once every shard has finished
+                           (local testing)
+        - LambdaExecutor:  asynchronous (Event) invocations of the loader
+                           function; returns at once (production)
+
+    orchestrate() records a pending run in S3, dispatches the shards and
+    reduces the run straight away when every shard has already reported.
+    Otherwise the run stays pending:  in production the orchestrator
+    never waits on loaders, whose runs use nearly their whole Lambda
+    budget, and the scheduled reducer (reduce_handler) merges and
+    publishes the run once every shard has reported or
+    SHARD_RESULT_TIMEOUT has passed:
+
+        orchestrator/pending/<run_id>.json      run pending reduction
+        orchestrator/<run_id>/shard-<n>.json    shard results
+        orchestrator/<run_id>/summary.json      merged digest
+
+    A full fleet load completes in the time of its largest shard.
+
+    Lambda handlers:  orchestrator.lambda_handler (map),
+                      orchestrator.reduce_handler (reduce)
+
+"""
+import time
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+from pyaws.awslambda import read_env_variable
+from reporting import build_digest, format_digest, prefetch_identity, publish
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+# relative raw archive volume per region (GB), cloudformation/load_groups.md
+REGION_WEIGHTS = {
+    'ap-south-1': 2.57,
+    'eu-north-1': 0.0,
+    'eu-west-1': 11.04,
+    'eu-west-2': 1.33,
+    'eu-west-3': 0.01,
+    'ap-northeast-1': 7.44,
+    'ap-northeast-2': 2.78,
+    'ap-northeast-3': 0.0,
+    'ca-central-1': 1.12,
+    'sa-east-1': 5.52,
+    'ap-southeast-1': 7.68,
+    'ap-southeast-2': 6.34,
+    'eu-central-1': 7.02,
+    'us-east-1': 34.51,
+    'us-east-2': 2.03,
+    'us-west-1': 7.45,
+    'us-west-2': 18.88
+}
+
+
+def shard_regions(regions, shards, weights=None):
+    """
+    Summary.
+
+        Splits regions into balanced shards; each region in descending
+        weight order is assigned to the currently lightest shard
+
+    Args:
+        :regions (list):  AWS region codes
+        :shards (int):  maximum number of shards
+        :weights (dict):  region --> relative load; unknown regions weigh
+            the mean of known weights
+
+    Returns:
+        list of region lists, TYPE: list
+
+    """
+    weights = REGION_WEIGHTS if weights is None else weights
+    default = sum(weights.values()) / len(weights) if weights else 1
+    load = {x: weights.get(x, default) for x in regions}
+
+    bins = [[0, []] for _ in range(min(shards, len(regions)))]
+    for region in sorted(regions, key=lambda x: load[x], reverse=True):
+        lightest = min(bins, key=lambda x: x[0])
+        lightest[0] += load[region]
+        lightest[1].append(region)
+    return [x[1] for x in bins if x[1]]
+
+
+RESULTS_PREFIX = 'orchestrator'
+
+
+def pending_key(run_id):
+    return '/'.join([RESULTS_PREFIX, 'pending', run_id + '.json'])
+
+
+def result_key(run_id, index):
+    return '/'.join([RESULTS_PREFIX, run_id, 'shard-{}.json'.format(index + 1)])
+
+
+def summary_key(run_id):
+    return '/'.join([RESULTS_PREFIX, run_id, 'summary.json'])
+
+
+def shard_event(regions, index, run_id, bucket):
+    """
+        Scheduled event consumed by cli.lambda_handler for one shard; the
+        loader writes its result to bucket for the reducer
+    """
+    return {
+        'region': read_env_variable('DEFAULT_REGION', 'us-east-2'),
+        'detail': {
+            'eventName': 'OrchestratorShard{}'.format(index + 1),
+            'responseElements': ','.join(regions)
+        },
+        'orchestrator': {'run_id': run_id, 'bucket': bucket, 'result_key': result_key(run_id, index)}
+    }
+
+
+def _run_local(event):
+    """Process pool worker:  runs the loader handler for one shard"""
+    import cli
+    return cli.lambda_handler(event, None)
+
+
+class LocalExecutor():
+    """Runs shards in local worker processes and waits for them"""
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+
+    def dispatch(self, events):
+        """
+        Returns:
+            dispatch error per event, None when the shard ran, TYPE: list
+        """
+        with ProcessPoolExecutor(max_workers=self.max_workers or len(events)) as executor:
+            futures = [executor.submit(_run_local, x) for x in events]
+            return [self._error(x) for x in futures]
+
+    @staticmethod
+    def _error(future):
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception('Shard worker process failed: {}'.format(e))
+            return str(e)
+        return None
+
+
+class LambdaExecutor():
+    """
+        Runs each shard in its own asynchronous (Event) invocation of the
+        loader function without waiting for it
+    """
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.client = boto3.client('lambda')
+
+    def dispatch(self, events):
+        """
+        Returns:
+            dispatch error per event, None when the invocation was
+            accepted, TYPE: list
+        """
+        errors = []
+        for event in events:
+            try:
+                response = self.client.invoke(
+                    FunctionName=self.function_name,
+                    InvocationType='Event',
+                    Payload=serializers.dumps(event)
+                )
+                status = response['StatusCode']
+                errors.append(None if status == 202 else 'invocation returned status {}'.format(status))
+            except ClientError as e:
+                logger.exception('Problem invoking {}: {}'.format(self.function_name, e))
+                errors.append(str(e))
+        return errors
+
+
+def orchestrate(regions, shards, executor, bucket, timeout):
+    """
+    Summary.
+
+        Splits regions into shards, records a pending run in S3,
+        dispatches the shards through executor and reduces the run when
+        every shard result is already available
+
+    Args:
+        :regions (list):  AWS region codes
+        :shards (int):  number of shards
+        :executor (LocalExecutor | LambdaExecutor):  shard executor
+        :bucket (str):  bucket receiving shard results
+        :timeout (int):  seconds after which a missing result counts as
+            a failed shard
+
+    Returns:
+        merged summary, or the pending run while shards are outstanding,
+        TYPE: dict
+
+    """
+    run_id = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H%M%SZ')
+    region_shards = shard_regions(regions, shards)
+    for index, shard in enumerate(region_shards):
+        logger.info('Shard {}: {}'.format(index + 1, ','.join(shard)))
+
+    run = {'run_id': run_id, 'started': time.time(), 'shards': region_shards}
+    s3client = boto3.client('s3')
+    s3client.put_object(Bucket=bucket, Key=pending_key(run_id), Body=serializers.dumps(run))
+
+    run['errors'] = executor.dispatch([shard_event(x, i, run_id, bucket) for i, x in enumerate(region_shards)])
+    s3client.put_object(Bucket=bucket, Key=pending_key(run_id), Body=serializers.dumps(run))
+    logger.info('Run {} dispatched {} of {} shards'.format(
+        run_id, run['errors'].count(None), len(region_shards)))
+
+    return reduce_run(bucket, run, timeout) or run
+
+
+def gather(bucket, run, timeout):
+    """
+    Summary.
+
+        Collects the shard results of a run
+
+    Args:
+        :bucket (str):  results bucket
+        :run (dict):  pending run written by orchestrate
+        :timeout (int):  seconds after which a missing result counts as
+            a failed shard
+
+    Returns:
+        (results, complete), TYPE: tuple (list, bool)
+
+    """
+    s3client = boto3.client('s3')
+    expired = time.time() - run['started'] > timeout
+    results = []
+
+    for index, error in enumerate(run.get('errors', [None] * len(run['shards']))):
+        if error is not None:
+            results.append({'error': error})
+            continue
+        try:
+            key = result_key(run['run_id'], index)
+            results.append(serializers.loads(s3client.get_object(Bucket=bucket, Key=key)['Body'].read()))
+        except ClientError:
+            if not expired:
+                return results, False
+            results.append({'error': 'no shard result after {}s'.format(timeout)})
+    return results, True
+
+
+def reduce_run(bucket, run, timeout):
+    """
+        Merges and publishes one run once complete or expired
+
+    Returns:
+        digest, TYPE: dict; None while shard results are outstanding
+    """
+    results, complete = gather(bucket, run, timeout)
+    if not complete:
+        return None
+
+    finished = [x['finished'] for x in results if isinstance(x, dict) and 'finished' in x]
+    elapsed = max(finished) - run['started'] if finished else None
+    summary = build_digest(results, run['shards'], elapsed)
+
+    msg = format_digest(summary)
+    logger.info('Run {}: {}'.format(run['run_id'], msg))
+    summary['published'] = publish('SpotPrice fleet load summary', msg)
+
+    s3client = boto3.client('s3')
+    s3client.put_object(Bucket=bucket, Key=summary_key(run['run_id']), Body=serializers.dumps(summary, pretty=True))
+    s3client.delete_object(Bucket=bucket, Key=pending_key(run['run_id']))
+    return summary
+
+
+def lambda_handler(event, context):
+    """
+    Orchestrate a full fleet load; TARGET_REGIONS from the event
+    (detail.responseElements) or environment
+    """
+    try:
+        TARGET_REGIONS = event['detail']['responseElements'].split(',')
+    except (KeyError, TypeError):
+        TARGET_REGIONS = read_env_variable('TARGET_REGIONS').split(',')
+
+    BUCKET = read_env_variable('S3_BUCKET')
+    SHARDS = int(read_env_variable('SHARDS', 5))
+    TIMEOUT = int(read_env_variable('SHARD_RESULT_TIMEOUT', 3600))
+    EXECUTOR = read_env_variable('SHARD_EXECUTOR', 'lambda')
+
+    logger.info('<-- SPOTPRICE ORCHESTRATOR VERSION {} START -->'.format(__version__))
+    prefetch_identity()
+
+    if EXECUTOR == 'local':
+        executor = LocalExecutor()
+    else:
+        executor = LambdaExecutor(read_env_variable('WORKER_FUNCTION'))
+
+    summary = orchestrate(TARGET_REGIONS, SHARDS, executor, BUCKET, TIMEOUT)
+    loggers.flush()
+    return summary
+
+
+def reduce_handler(event, context):
+    """
+    Reduce pending runs whose shards have all reported or timed out
+    """
+    BUCKET = read_env_variable('S3_BUCKET')
+    TIMEOUT = int(read_env_variable('SHARD_RESULT_TIMEOUT', 3600))
+
+    prefetch_identity()
+    s3client = boto3.client('s3')
+    paginator = s3client.get_paginator('list_objects_v2')
+    reduced = []
+
+    for page in paginator.paginate(Bucket=BUCKET, Prefix='/'.join([RESULTS_PREFIX, 'pending', ''])):
+        for item in page.get('Contents', []):
+            run = serializers.loads(s3client.get_object(Bucket=BUCKET, Key=item['Key'])['Body'].read())
+            if reduce_run(BUCKET, run, TIMEOUT) is not None:
+                reduced.append(run['run_id'])
+    loggers.flush()
+    return {'reduced': reduced}
@@ -0,0 +1,202 @@
+"""
+
+reporting (python3)
+
+    Load summary digests and off-critical-path notification.
+
+    build_digest() merges any number of shard results (the dict returned
+    by cli.lambda_handler) into one digest:  totals, throughput, shard
+    durations and per region records, DynamoDB failures and archive
+    upload status.  publish() sends the digest to Amazon SNS on a
+    background thread and waits at most REPORT_TIMEOUT seconds; a slow or
+    failing notification is logged and never fails the ingestion run.
+
+    Account identity (STS, IAM) is resolved once per container and reused
+    by every notification; prefetch_identity() resolves it in the
+    background while the load is running.
+
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from pyaws.awslambda import read_env_variable
+from lambda_utils import get_account_info, sns_notification
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='report')
+_identity = None        # persists for the container lifetime
+_identity_lock = threading.Lock()
+
+
+def account_identity():
+    """
+    Summary.
+
+        Account number and alias, cached after the first successful lookup
+
+    Returns:
+        (account_id, account_name), TYPE: tuple
+
+    """
+    global _identity
+
+    with _identity_lock:
+        if _identity is None:
+            try:
+                _identity = get_account_info()
+            except Exception as e:
+                logger.warning('Account identity unavailable: {}'.format(e))
+                return ('unknown', 'unknown')
+        return _identity
+
+
+def prefetch_identity():
+    """Resolves account identity in the background"""
+    if _identity is None:
+        _executor.submit(account_identity)
+
+
+def build_digest(results, shards=None, elapsed=None):
+    """
+    Summary.
+
+        Merges shard results into one load digest
+
+    Args:
+        :results (list):  shard result dictionaries; non-dict results or
+            results carrying an 'error' key count as failed shards
+        :shards (list):  region list of each shard, parallel to results
+        :elapsed (float):  wall clock seconds of the whole load; defaults
+            to the longest shard duration
+
+    Returns:
+        digest, TYPE: dict
+
+    """
+    shards = shards or [x.get('regions', []) if isinstance(x, dict) else [] for x in results]
+    digest = {
+        'shards': len(results),
+        'records': 0,
+        'committed': 0,
+        'failed': 0,
+        'remaining': 0,
+        'stopped': False,
+        'regions': {},
+        'failed_shards': [],
+        'durations': []
+    }
+    for regions, result in zip(shards, results):
+        if not isinstance(result, dict) or 'error' in result:
+            error = result.get('error') if isinstance(result, dict) else result
+            digest['failed_shards'].append({'regions': regions, 'error': error})
+            continue
+        for key in ('records', 'committed', 'failed', 'remaining'):
+            digest[key] += result.get(key, 0)
+        digest['stopped'] = digest['stopped'] or bool(result.get('stopped'))
+        digest['durations'].append(result.get('duration', 0))
+
+        region_load = result.get('region_load', {})
+        for region in result.get('regions', regions):
+            digest['regions'][region] = {
+                'records': result.get('region_records', {}).get(region, 0),
+                'committed': region_load.get(region, {}).get('committed', 0),
+                'failed': region_load.get(region, {}).get('failed', 0),
+                'upload': result.get('uploads', {}).get(region)
+            }
+
+    digest['largest_shard_duration'] = max(digest['durations'] or [0])
+    digest['elapsed'] = round(elapsed if elapsed is not None else digest['largest_shard_duration'], 1)
+    digest['throughput'] = round(digest['committed'] / digest['elapsed'], 1) if digest['elapsed'] else 0
+    return digest
+
+
+def format_digest(digest):
+    """Plain text rendering of a digest for logs and notifications"""
+    lines = [
+        'Load of {records} records across {shards} shard(s) in {elapsed}s '
+        '(largest shard {largest_shard_duration}s, {throughput} records/s)'.format(**digest),
+        '\t- Committed: {committed}'.format(**digest),
+        '\t- Failed: {failed}'.format(**digest),
+        '\t- Remaining: {remaining}'.format(**digest)
+    ]
+    if digest['stopped']:
+        lines.append('\t- Load stopped early to meet the Lambda deadline')
+    if digest['regions']:
+        lines.append('Regions:')
+        for region, status in sorted(digest['regions'].items()):
+            lines.append(
+                '\t- {}: {records} records, {committed} committed, {failed} failed, '
+                'archive upload {upload}'.format(region, **status)
+            )
+    for shard in digest['failed_shards']:
+        lines.append('Failed shard {}: {}'.format(','.join(shard['regions']), shard['error']))
+    return '\n'.join(lines)
+
+
+def _notify(topic_arn, subject, message):
+    account_id, account_name = account_identity()
+    return sns_notification(topic_arn, subject, message, account_id=account_id, account_name=account_name)
+
+
+def publish(subject, message, topic_arn=None, timeout=None):
+    """
+    Summary.
+
+        Sends a notification on a background thread, waiting at most
+        timeout seconds.  A notification still in flight at the timeout
+        completes in the background (or on the next warm invocation)
+
+    Args:
+        :subject (str):  notification subject
+        :message (str):  notification body
+        :topic_arn (str):  sns topic arn; default SNS_TOPIC_ARN
+        :timeout (float):  seconds to wait; default REPORT_TIMEOUT (3)
+
+    Returns:
+        Success | Failure, TYPE: bool
+
+    """
+    topic_arn = topic_arn or read_env_variable('SNS_TOPIC_ARN')
+    timeout = float(read_env_variable('REPORT_TIMEOUT', 3)) if timeout is None else timeout
+
+    if not topic_arn:
+        return False
+
+    started = time.monotonic()
+    try:
+        future = _executor.submit(_notify, topic_arn, subject, message)
+        return bool(future.result(timeout=timeout))
+    except TimeoutError:
+        logger.warning('Notification still pending after {}s; continuing'.format(timeout))
+    except Exception as e:
+        logger.exception('Problem publishing notification: {}'.format(e))
+    finally:
+        logger.info('Notification dispatch took {:.2f}s'.format(time.monotonic() - started))
+    return False
+
+
+def report(results, subject, shards=None, elapsed=None, timeout=None, notify=True):
+    """
+    Summary.
+
+        Logs and publishes the digest of one or more shard results
+
+    Args:
+        :notify (bool):  publish the digest to SNS; False only logs it
+
+    Returns:
+        digest, TYPE: dict; key 'published' holds the publish status
+
+    """
+    try:
+        digest = build_digest(results, shards, elapsed)
+        message = format_digest(digest)
+        logger.info(message)
+        digest['published'] = publish(subject, message, timeout=timeout) if notify else False
+        return digest
+    except Exception as e:
+        logger.exception('Unknown error generating summary report: {}'.format(e))
+        return {'published': False}
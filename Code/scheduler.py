@@ -0,0 +1,59 @@
+"""
+
+scheduler (python3)
+
+    Partition-aware write scheduling for bulk DynamoDB loads.
+
+    Spot price records arrive clustered by timestamp and availability
+    zone.  Slicing the list by position hands each writer long runs of
+    the same partition key (Timestamp), so every writer hits one
+    partition at a time and is throttled while total table capacity sits
+    idle.  partition_schedule() groups records into partition key hash
+    buckets and deals them round-robin across buckets and then across
+    workers in batch sized blocks, so every batch spreads its writes over
+    many partitions.
+
+"""
+import zlib
+from collections import deque
+
+
+def _bucket(value, buckets):
+    return zlib.crc32(str(value).encode('utf-8')) % buckets
+
+
+def partition_schedule(items, workers, partition_key='Timestamp', buckets=256, batch_size=25):
+    """
+    Summary.
+
+        Interleaves items across partition key hash buckets and workers
+
+    Args:
+        :items (list):  spot price dictionaries
+        :workers (int):  number of writer threads
+        :partition_key (str):  table hash key attribute
+        :buckets (int):  number of partition key hash buckets
+        :batch_size (int):  items per writer batch; consecutive round-robin
+            items (distinct buckets) are dealt to a worker in blocks of
+            this size
+
+    Returns:
+        one list of item indexes per worker, TYPE: list
+
+    """
+    grouped = {}
+    for index, item in enumerate(items):
+        grouped.setdefault(_bucket(item[partition_key], buckets), deque()).append(index)
+
+    queues = deque(grouped.values())
+    schedule = [[] for _ in range(workers)]
+    position = 0
+
+    # one index from each non-empty bucket per round
+    while queues:
+        queue = queues.popleft()
+        schedule[position // batch_size % workers].append(queue.popleft())
+        position += 1
+        if queue:
+            queues.append(queue)
+    return schedule
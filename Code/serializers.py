@@ -0,0 +1,159 @@
+"""
+
+serializers (python3)
+
+    Pluggable JSON encode / decode layer used by every read and write
+    path of the spot price loader (S3 archives, local files, SNS and
+    debug output).
+
+    Backend preference:  orjson --> ujson --> json (stdlib).  The fastest
+    library importable in the Lambda runtime is selected at import time;
+    set environment variable JSON_BACKEND to force a specific backend.
+
+    All backends emit identical compact documents for the record types
+    produced by the loader (utf-8, '/' unescaped):  datetime objects are
+    rendered in ISO 8601 format and Decimal values as strings.  ujson is
+    the one exception for Decimal, which it encodes natively as a number.
+
+"""
+import os
+import json
+import datetime
+from decimal import Decimal
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _default(obj):
+    """Fallback encoder for types the json libraries do not handle natively"""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj)
+    return str(obj)
+
+
+def _orjson_dumps(obj, pretty=False):
+    option = orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+def _ujson_dumps(obj, pretty=False):
+    return ujson.dumps(
+            obj, default=_default, ensure_ascii=False, escape_forward_slashes=False,
+            indent=2 if pretty else 0
+        ).encode('utf-8')
+
+
+def _json_dumps(obj, pretty=False):
+    if pretty:
+        return json.dumps(obj, default=_default, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(data):
+    return json.loads(data)
+
+
+BACKENDS = {'json': (_json_dumps, _json_loads)}
+
+if ujson is not None:
+    BACKENDS['ujson'] = (_ujson_dumps, ujson.loads)
+
+if orjson is not None:
+    BACKENDS['orjson'] = (_orjson_dumps, orjson.loads)
+
+
+def _select_backend(preference=('orjson', 'ujson', 'json')):
+    forced = os.environ.get('JSON_BACKEND')
+    if forced:
+        if forced in BACKENDS:
+            return forced
+        logger.warning('JSON_BACKEND {} unavailable, selecting fastest installed backend'.format(forced))
+    return [x for x in preference if x in BACKENDS][0]
+
+
+BACKEND = _select_backend()
+
+
+def dumps(obj, pretty=False, backend=None):
+    """
+    Summary.
+
+        Encodes a python object as a utf-8 json document
+
+    Args:
+        :obj (dict | list):  object to serialize
+        :pretty (bool):  indent output for human consumption; production
+            archives are written compact
+        :backend (str):  override the module backend (orjson, ujson, json)
+
+    Returns:
+        encoded document, TYPE: bytes
+
+    """
+    return BACKENDS[backend or BACKEND][0](obj, pretty)
+
+
+def loads(data, backend=None):
+    """
+    Summary.
+
+        Decodes a json document
+
+    Args:
+        :data (bytes | str):  json document
+        :backend (str):  override the module backend (orjson, ujson, json)
+
+    Returns:
+        decoded python object, TYPE: dict | list
+
+    """
+    return BACKENDS[backend or BACKEND][1](data)
+
+
+def dump_file(obj, filename, pretty=False):
+    """
+    Summary.
+
+        Persists a python object as json to the local filesystem
+
+    Returns:
+        Success | Failure, TYPE: bool
+
+    """
+    try:
+        with open(filename, 'wb') as f1:
+            f1.write(dumps(obj, pretty=pretty))
+    except (OSError, TypeError, ValueError) as e:
+        logger.exception('Problem serializing object to {}: {}'.format(filename, e))
+        return False
+    return True
+
+
+def load_file(filename):
+    """
+    Summary.
+
+        Reads a json document from the local filesystem
+
+    Returns:
+        decoded python object, TYPE: dict | list
+
+    """
+    with open(filename, 'rb') as f1:
+        return loads(f1.read())
@@ -0,0 +1,306 @@
+"""
+
+sketches (python3)
+
+    Mergeable streaming quantile sketches of spot prices.
+
+    TDigest is a merging t-digest (k1 scale function):  bounded memory
+    of roughly `compression` centroids per series regardless of the
+    number of prices added, mergeable across shards and runs with small
+    relative error at the tails (p90, p99).
+
+    SketchStore keeps one digest per (region, InstanceType,
+    ProductDescription) series and persists compactly to Amazon S3, one
+    object per region per day, built from every retrieved price sample
+    (sketch_records):
+
+        sketches/<region>/<YYYY-MM-DD>.json
+
+    query_quantiles() answers percentile queries over arbitrary date
+    ranges by merging the daily sketches, without rescanning archives.
+
+"""
+import math
+import base64
+import struct
+import datetime
+import boto3
+from botocore.exceptions import ClientError
+from validation import price_value
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+_header = struct.Struct('<HddI')
+_centroid = struct.Struct('<ff')
+
+
+class TDigest():
+    """
+        Merging t-digest
+
+    Args:
+        :compression (int):  accuracy / size trade off (delta); the digest
+            holds at most ~compression centroids after compression
+
+    """
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.buffer = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        self._compress()
+        return len(self.means)
+
+    def add(self, value, weight=1):
+        self.buffer.append((value, weight))
+        self.count += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.buffer) >= self.compression * 5:
+            self._compress()
+
+    def _q_limit(self, q):
+        """Upper quantile bound of a centroid starting at q (k1 scale)"""
+        q = min(max(q, 0.0), 1.0)
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        k = min(k, self.compression / 4)
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self.buffer:
+            return
+        items = sorted(list(zip(self.means, self.weights)) + self.buffer)
+        self.buffer = []
+        total = sum(x[1] for x in items)
+
+        means, weights = [], []
+        mean, weight = items[0]
+        q0 = 0.0
+        limit = self._q_limit(q0)
+
+        for value, w in items[1:]:
+            if q0 + (weight + w) / total <= limit:
+                weight += w
+                mean += (value - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                q0 += weight / total
+                limit = self._q_limit(q0)
+                mean, weight = value, w
+
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def merge(self, other):
+        """Adds the centroids of another digest to this digest"""
+        other._compress()
+        self.buffer.extend(zip(other.means, other.weights))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+            Estimated value at quantile q (0 <= q <= 1); None when empty
+        """
+        self._compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+
+        target = q * self.count
+        if target <= self.weights[0] / 2:
+            return self.min + (self.means[0] - self.min) * target / (self.weights[0] / 2)
+
+        cumulative = self.weights[0] / 2
+        for i in range(len(self.means) - 1):
+            step = (self.weights[i] + self.weights[i + 1]) / 2
+            if target <= cumulative + step:
+                fraction = (target - cumulative) / step
+                return self.means[i] + (self.means[i + 1] - self.means[i]) * fraction
+            cumulative += step
+
+        tail = self.weights[-1] / 2
+        fraction = min((target - cumulative) / tail, 1.0)
+        return self.means[-1] + (self.max - self.means[-1]) * fraction
+
+    def to_bytes(self):
+        self._compress()
+        return _header.pack(self.compression, self.min, self.max, len(self.means)) + b''.join(
+            _centroid.pack(m, w) for m, w in zip(self.means, self.weights)
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        compression, minimum, maximum, n = _header.unpack_from(data, 0)
+        digest = cls(compression)
+        digest.min, digest.max = minimum, maximum
+        for i in range(n):
+            m, w = _centroid.unpack_from(data, _header.size + i * _centroid.size)
+            digest.means.append(m)
+            digest.weights.append(w)
+        digest.count = sum(digest.weights)
+        return digest
+
+
+class SketchStore():
+    """
+        One TDigest per (region, InstanceType, ProductDescription) series,
+        built in one pass by sketch_records; not thread safe
+    """
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.digests = {}
+
+    def __len__(self):
+        return len(self.digests)
+
+    def add(self, region, instance_type, product, price):
+        key = (region, instance_type, product)
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = TDigest(self.compression)
+        digest.add(price_value(price))
+
+    def merge(self, other):
+        for key, digest in other.digests.items():
+            if key in self.digests:
+                self.digests[key].merge(digest)
+            else:
+                self.digests[key] = TDigest(digest.compression).merge(digest)
+        return self
+
+    def regions(self):
+        return sorted({x[0] for x in self.digests})
+
+    def subset(self, region):
+        """Store containing only the series of one region"""
+        store = SketchStore(self.compression)
+        store.digests = {k: v for k, v in self.digests.items() if k[0] == region}
+        return store
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99)):
+        """series key --> {quantile: price}"""
+        return {k: {q: v.quantile(q) for q in qs} for k, v in self.digests.items()}
+
+    def dumps(self):
+        return serializers.dumps({
+            '|'.join(k): base64.b64encode(v.to_bytes()).decode('ascii') for k, v in self.digests.items()
+        })
+
+    @classmethod
+    def loads(cls, data):
+        store = cls()
+        for k, v in serializers.loads(data).items():
+            store.digests[tuple(k.split('|'))] = TDigest.from_bytes(base64.b64decode(v))
+        return store
+
+
+def sketch_records(records, regions, compression=100):
+    """
+    Summary.
+
+        Builds the sketches of a set of spot price records
+
+    Args:
+        :records (iterable):  spot price dictionaries
+        :regions (list):  AWS region codes; a record belongs to the region
+            prefixing its AvailabilityZone
+
+    Returns:
+        sketches, TYPE: SketchStore
+
+    """
+    store = SketchStore(compression)
+    zones = {}          # AvailabilityZone --> region
+
+    for record in records:
+        az = record['AvailabilityZone']
+        region = zones.get(az)
+        if region is None:
+            region = zones[az] = next((x for x in regions if az.startswith(x)), '')
+        if region:
+            store.add(region, record['InstanceType'], record['ProductDescription'], record['SpotPrice'])
+    return store
+
+
+def sketch_key(region, date):
+    return 'sketches/{}/{}.json'.format(region, date.isoformat())
+
+
+def upload_sketches(bucket, store, date):
+    """
+    Summary.
+
+        Writes the daily sketch object of each region held in store.  A
+        region is loaded once per day, so objects are overwritten (a retry
+        never double counts); runs and dates are merged at query time.
+        store must hold the complete day of each region it contains
+
+    Returns:
+        region --> Success | Failure, TYPE: dict
+
+    """
+    s3client = boto3.client('s3')
+    status = {}
+
+    for region in store.regions():
+        key = sketch_key(region, date)
+        try:
+            s3client.put_object(Bucket=bucket, Key=key, Body=store.subset(region).dumps())
+            status[region] = True
+        except ClientError as e:
+            logger.exception('Problem writing sketch {}: {}'.format(key, e))
+            status[region] = False
+    return status
+
+
+def query_quantiles(bucket, region, start_date, end_date, qs=(0.5, 0.9, 0.99), instance_type=None):
+    """
+    Summary.
+
+        Price quantiles per series across a date range, merged from the
+        daily sketches in Amazon S3
+
+    Args:
+        :bucket (str):  archive bucket
+        :region (str):  AWS region code
+        :start_date, end_date (datetime.date):  inclusive date range
+        :qs (tuple):  quantiles to report
+        :instance_type (str):  restrict the result to one instance type
+
+    Returns:
+        (InstanceType, ProductDescription) --> {quantile: price}, TYPE: dict
+
+    """
+    s3client = boto3.client('s3')
+    merged = SketchStore()
+    date = start_date
+
+    while date <= end_date:
+        try:
+            body = s3client.get_object(Bucket=bucket, Key=sketch_key(region, date))['Body'].read()
+            merged.merge(SketchStore.loads(body))
+        except ClientError as e:
+            logger.info('No sketch for region {} on {}: {}'.format(region, date, e))
+        date += datetime.timedelta(days=1)
+
+    return {
+        k[1:]: v for k, v in merged.quantiles(qs).items()
+        if instance_type is None or k[1] == instance_type
+    }
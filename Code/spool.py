@@ -0,0 +1,223 @@
+"""
+
+spool (python3)
+
+    Durable append-only record spool in Lambda /tmp scratch space.
+
+    Retrieved spot price records are appended to a spool file as length
+    prefixed compact json records:
+
+        [4 byte little-endian length][record bytes] ...
+
+    A sidecar state file records whether retrieval completed (sealed) and
+    a commit offset per sink (e.g. 'dynamodb').  Sinks acknowledge record
+    ranges in any order; the commit offset advances only through
+    contiguous acknowledged ranges, so a warm retry after a crash or
+    timeout replays from the first uncommitted record instead of
+    re-fetching from EC2.  Records are read back through a memory map.
+
+    Spool names are unique to a region set and retrieval window, so a
+    spool abandoned by a failed load is never replayed by a later
+    window; remove_stale() deletes such leftovers to keep /tmp free.
+
+"""
+import os
+import glob
+import mmap
+import struct
+import hashlib
+import threading
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+_prefix = struct.Struct('<I')
+
+
+def window_digest(regions, start, end):
+    """Short digest unique to a set of regions and retrieval window"""
+    return hashlib.sha1(
+        '|'.join(sorted(regions) + [start.isoformat(), end.isoformat()]).encode('utf-8')
+    ).hexdigest()[:16]
+
+
+def spool_path(regions, start, end, tmpdir='/tmp'):
+    """Spool filename unique to a set of regions and retrieval window"""
+    return os.path.join(tmpdir, 'spotprices-{}.spool'.format(window_digest(regions, start, end)))
+
+
+def remove_stale(current, tmpdir='/tmp'):
+    """
+    Summary.
+
+        Deletes spool and state files of other region sets or retrieval
+        windows, left behind by loads which did not complete
+
+    Args:
+        :current (str):  path of the spool in use, retained
+
+    Returns:
+        number of files removed, TYPE: int
+
+    """
+    removed = 0
+    for path in glob.glob(os.path.join(tmpdir, 'spotprices-*.spool*')):
+        if path == current or path.startswith(current + '.'):
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning('Unable to remove stale spool file {}: {}'.format(path, e))
+    if removed:
+        logger.info('Removed {} stale spool files from {}'.format(removed, tmpdir))
+    return removed
+
+
+class Spool():
+    """
+        Append-only, memory mapped record spool with per sink commit offsets
+
+    Args:
+        :path (str):  spool file location; state is kept in path + '.state'
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.state_path = path + '.state'
+        self.lock = threading.Lock()
+        self.acked = {}         # sink --> {start offset: end offset}
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            return serializers.load_file(self.state_path)
+        except (OSError, ValueError):
+            return {'sealed': False, 'offsets': {}}
+
+    def _save_state(self):
+        """
+            Atomic replace of the state file.  No fsync: a Lambda timeout
+            ends the process, not the container kernel holding the page cache
+        """
+        tmpfile = self.state_path + '.tmp'
+        try:
+            with open(tmpfile, 'wb') as f1:
+                f1.write(serializers.dumps(self.state))
+            os.replace(tmpfile, self.state_path)
+        except OSError as e:
+            logger.warning('Unable to persist spool state {}: {}'.format(self.state_path, e))
+
+    @property
+    def sealed(self):
+        """True when record retrieval completed and the spool is replayable"""
+        return self.state['sealed'] and os.path.exists(self.path)
+
+    def write(self, records):
+        """
+        Summary.
+
+            Replaces spool contents with records and seals the spool.
+            On a write error (e.g. ENOSPC) the partial spool is deleted
+            and the error raised
+
+        Returns:
+            number of records spooled, TYPE: int
+
+        """
+        self.state = {'sealed': False, 'offsets': {}}
+        self._save_state()
+        count = 0
+
+        try:
+            with open(self.path, 'wb') as f1:
+                for record in records:
+                    payload = serializers.dumps(record)
+                    f1.write(_prefix.pack(len(payload)))
+                    f1.write(payload)
+                    count += 1
+        except OSError:
+            self.remove()
+            raise
+
+        self.state['sealed'] = True
+        self._save_state()
+        return count
+
+    def read(self, offset=0):
+        """
+        Summary.
+
+            Streams records from offset to the last complete record
+
+        Yields:
+            (start offset, end offset, record), TYPE: tuple
+
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb') as f1:
+            with mmap.mmap(f1.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                while offset + _prefix.size <= size:
+                    length = _prefix.unpack_from(mm, offset)[0]
+                    end = offset + _prefix.size + length
+                    if end > size:
+                        logger.warning('Truncated record at offset {} in spool {}'.format(offset, self.path))
+                        break
+                    yield offset, end, serializers.loads(mm[offset + _prefix.size:end])
+                    offset = end
+
+    def committed(self, sink):
+        """Commit offset of sink"""
+        return self.state['offsets'].get(sink, 0)
+
+    def pending(self, sink):
+        """
+        Summary.
+
+            Records not yet committed by sink
+
+        Returns:
+            (records, offsets), TYPE: tuple; offsets[i] is the
+            (start, end) spool range of records[i]
+
+        """
+        records, offsets = [], []
+        for start, end, record in self.read(self.committed(sink)):
+            records.append(record)
+            offsets.append((start, end))
+        return records, offsets
+
+    def ack(self, sink, ranges):
+        """
+        Summary.
+
+            Acknowledges spool ranges written by sink and advances the
+            sink's commit offset through contiguous acknowledged ranges
+
+        Args:
+            :sink (str):  sink name, e.g. 'dynamodb'
+            :ranges (list):  (start, end) offset tuples
+
+        """
+        with self.lock:
+            acked = self.acked.setdefault(sink, {})
+            acked.update(ranges)
+            offset = self.committed(sink)
+            advanced = offset
+            while advanced in acked:
+                advanced = acked.pop(advanced)
+            if advanced != offset:
+                self.state['offsets'][sink] = advanced
+                self._save_state()
+
+    def remove(self):
+        """Deletes spool and state files once every sink has committed"""
+        for path in (self.path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
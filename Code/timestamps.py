@@ -0,0 +1,164 @@
+"""
+
+timestamps (python3)
+
+    Timestamp normalization for spot price records.
+
+    Spot price history repeats a small set of distinct timestamps across
+    hundreds of thousands of records.  Rather than formatting every record,
+    normalize_timestamps() formats each distinct datetime once (optionally
+    fanned out across a process pool in chunks) and assigns the cached
+    string back to the records in a single pass.
+
+    Every style yields a string:  Timestamp is the DynamoDB hash key
+    (attribute type S), so epoch seconds are written as decimal text.
+    The epoch seconds of every string produced are registered in EPOCHS,
+    so validation and to_epoch() resolve normalized timestamps with a
+    lookup rather than parsing them back.
+
+"""
+import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+utc = datetime.timezone.utc
+epoch = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+EPOCHS = {}             # valid timestamp (normalized text or epoch int) --> epoch seconds
+EPOCHS_LIMIT = 1000000  # entries retained across warm invocations
+
+
+def _as_utc(dt):
+    return dt.astimezone(utc) if dt.tzinfo is not None else dt
+
+
+def _iso(dt):
+    return _as_utc(dt).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _standard(dt):
+    return _as_utc(dt).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _epoch(dt):
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=utc)
+    return int((dt - epoch).total_seconds())
+
+
+def _epoch_text(dt):
+    return str(_epoch(dt))
+
+
+FORMATTERS = {
+    'iso': _iso,
+    'standard': _standard,
+    'epoch': _epoch_text
+}
+
+
+@lru_cache(maxsize=65536)
+def standardize_datetime(dt):
+    return _standard(dt)
+
+
+@lru_cache(maxsize=65536)
+def utc_datetime(dt):
+    return _iso(dt)
+
+
+@lru_cache(maxsize=65536)
+def datetimify_standard(s):
+    """Function to create timezone unaware string"""
+    return datetime.datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
+
+
+def _format_chunk(args):
+    """Process pool worker:  formats one chunk of distinct datetimes"""
+    style, chunk = args
+    fx = FORMATTERS[style]
+    return [fx(dt) for dt in chunk]
+
+
+def _format_distinct(distinct, style, workers, chunksize):
+    """
+        Formats distinct datetimes, in parallel when worth the process
+        start up cost.  Falls back to a serial pass where the runtime
+        lacks process pool support (AWS Lambda has no /dev/shm)
+    """
+    if workers > 1 and len(distinct) > chunksize:
+        chunks = [distinct[i:i + chunksize] for i in range(0, len(distinct), chunksize)]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(_format_chunk, [(style, x) for x in chunks])
+                return [x for chunk in results for x in chunk]
+        except (OSError, NotImplementedError) as e:
+            logger.warning('Process pool unavailable ({}), formatting timestamps serially'.format(e))
+    return _format_chunk((style, distinct))
+
+
+def normalize_timestamps(records, style='iso', key='Timestamp', workers=1, chunksize=20000):
+    """
+    Summary.
+
+        Converts datetime objects in spot price records to strings in
+        place.  Replaces spotlib UtcConversion in the hot path
+
+    Args:
+        :records (list):  list of spot price dictionaries
+        :style (str):  output format; one of 'iso' (2020-01-01T00:00:00Z),
+            'standard' (2020-01-01 00:00:00), or 'epoch' (seconds as text,
+            1577836800)
+        :key (str):  record key containing the datetime value
+        :workers (int):  number of processes used to format distinct values
+        :chunksize (int):  distinct datetimes formatted per process task
+
+    Returns:
+        records, TYPE: list
+
+    """
+    if style not in FORMATTERS:
+        raise ValueError('Unknown timestamp style: {}'.format(style))
+
+    distinct = list({x[key] for x in records if isinstance(x[key], datetime.datetime)})
+    lookup = dict(zip(distinct, _format_distinct(distinct, style, workers, chunksize)))
+
+    if len(EPOCHS) + len(lookup) > EPOCHS_LIMIT:
+        EPOCHS.clear()
+    EPOCHS.update((v, _epoch(k)) for k, v in lookup.items())
+
+    for record in records:
+        value = lookup.get(record[key])
+        if value is not None:
+            record[key] = value
+    return records
+
+
+@lru_cache(maxsize=65536)
+def _parse_epoch(value):
+    if value.isdigit():
+        return int(value)
+    for fmt in ('%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return _epoch(datetime.datetime.strptime(value, fmt))
+        except ValueError:
+            continue
+    return _epoch(datetime.datetime.fromisoformat(value))
+
+
+def to_epoch(value):
+    """
+        Returns epoch seconds for a record timestamp in any of the
+        normalized styles (iso, standard or epoch str), an epoch int or a
+        datetime
+    """
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime.datetime):
+        return _epoch(value)
+    seconds = EPOCHS.get(value)
+    return seconds if seconds is not None else _parse_epoch(value)
@@ -0,0 +1,206 @@
+"""
+
+validation (python3)
+
+    Record validation and normalization between retrieval and sinks.
+
+    validate_records() checks every spot price record against the loader
+    schema in a single pass and normalizes it in place:
+
+        - required fields are fetched with one precompiled itemgetter;
+          a missing field or wrong type rejects the record
+        - SpotPrice must be a plain non-negative decimal (0.0123);
+          surrounding whitespace is stripped.  It is parsed once per
+          distinct price string and the numeric value is memoized for
+          downstream consumers (price_value)
+        - Timestamp must resolve to epoch seconds (timestamps.to_epoch);
+          strings produced by normalize_timestamps are registered in
+          timestamps.EPOCHS, any other value is parsed once
+        - AvailabilityZone, InstanceType and ProductDescription are
+          stripped and interned through a lookup table, so repeated
+          values share one string object
+
+    SpotPrice keeps its source text:  it is the DynamoDB sort key (type S)
+    and is spooled and archived as json.  Rejected records are appended
+    to a Quarantine file with the reason for later inspection.
+
+"""
+import re
+import sys
+from operator import itemgetter
+import boto3
+from botocore.exceptions import ClientError
+from timestamps import EPOCHS, to_epoch
+import serializers
+import loggers
+from _version import __version__
+
+logger = loggers.getLogger(__version__)
+
+FIELDS = ('AvailabilityZone', 'InstanceType', 'ProductDescription', 'SpotPrice', 'Timestamp')
+
+_fields = itemgetter(*FIELDS)
+_price_syntax = re.compile(r'(\d+\.?\d*|\.\d+)\Z')
+_timestamp_types = frozenset((str, int))
+_prices = {}            # valid SpotPrice text --> float
+_strings = {}           # valid raw string --> canonical interned string
+
+
+def price_value(price):
+    """
+    Summary.
+
+        Numeric value of a SpotPrice string, parsed once per distinct
+        string
+
+    Raises:
+        ValueError when price is not a plain non-negative decimal
+
+    """
+    value = _prices.get(price)
+    if value is None:
+        if not isinstance(price, str) or not _price_syntax.match(price):
+            raise ValueError('invalid SpotPrice {!r}'.format(price))
+        value = _prices[price] = float(price)
+    return value
+
+
+def timestamp_value(timestamp):
+    """
+    Summary.
+
+        Epoch seconds of a record Timestamp, parsed once per distinct
+        value
+
+    Raises:
+        ValueError when timestamp is not a str or int epoch or
+        normalized datetime
+
+    """
+    if type(timestamp) not in _timestamp_types:
+        raise ValueError('invalid Timestamp {!r}'.format(timestamp))
+    value = EPOCHS.get(timestamp)
+    if value is None:
+        try:
+            value = EPOCHS[timestamp] = to_epoch(timestamp)
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError('invalid Timestamp {!r}'.format(timestamp))
+    return value
+
+
+class Quarantine():
+    """
+        Newline delimited json file of rejected records:
+
+            {"reason": "...", "record": {...}}
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.f1 = None
+
+    def add(self, record, reason):
+        if self.f1 is None:
+            self.f1 = open(self.path, 'wb')
+        self.f1.write(serializers.dumps({'reason': reason, 'record': record}) + b'\n')
+        self.count += 1
+
+    def close(self):
+        if self.f1 is not None:
+            self.f1.close()
+            self.f1 = None
+        return self.count
+
+    def upload(self, bucket, key):
+        """Copies the quarantine file to Amazon S3; Success | Failure, TYPE: bool"""
+        self.close()
+        try:
+            boto3.client('s3').upload_file(self.path, bucket, key)
+        except ClientError as e:
+            logger.exception('Problem writing quarantine file {}: {}'.format(key, e))
+            return False
+        logger.info('Quarantined {} rejected records to {}'.format(self.count, key))
+        return True
+
+
+def _admit(record):
+    """
+        Slow path for records with values not yet seen.  Validates the
+        record, normalizes it and registers its values in the lookup
+        tables used by the fast path
+
+    Returns:
+        reject reason, None when the record is valid, TYPE: str
+
+    """
+    if not isinstance(record, dict):
+        return 'not a mapping'
+    missing = [x for x in FIELDS if x not in record]
+    if missing:
+        return 'missing fields: {}'.format(', '.join(missing))
+
+    canonical = {}
+    for field in FIELDS[:3]:
+        value = record[field]
+        if not isinstance(value, str) or not value.strip():
+            return 'invalid {}'.format(field)
+        canonical[field] = _strings.get(value) or sys.intern(value.strip())
+
+    if not isinstance(record['SpotPrice'], str):
+        return 'invalid SpotPrice type'
+    try:
+        timestamp_value(record['Timestamp'])
+        price_value(record['SpotPrice'].strip())
+    except ValueError as e:
+        return str(e)
+
+    for field, value in canonical.items():
+        _strings[record[field]] = value
+        record[field] = value
+    record['SpotPrice'] = record['SpotPrice'].strip()
+    return None
+
+
+def validate_records(records, quarantine=None):
+    """
+    Summary.
+
+        Validates and normalizes spot price records in place.  The fast
+        path is a fixed sequence of lookups in tables of known-good
+        values; records carrying a value not seen before take the slow
+        path once (_admit)
+
+    Args:
+        :records (list):  spot price dictionaries
+        :quarantine (Quarantine):  sink for rejected records; rejects
+            are dropped (and counted) when None
+
+    Returns:
+        valid records, TYPE: list
+
+    """
+    valid = []
+    append = valid.append
+    fields, prices, strings, epochs = _fields, _prices, _strings, EPOCHS
+
+    for record in records:
+        try:
+            az, itype, product, price, ts = fields(record)
+            record['AvailabilityZone'] = strings[az]
+            record['InstanceType'] = strings[itype]
+            record['ProductDescription'] = strings[product]
+            prices[price]
+            epochs[ts]
+        except (KeyError, TypeError):
+            reason = _admit(record)
+            if reason is not None:
+                if quarantine is not None:
+                    quarantine.add(record, reason)
+                continue
+        append(record)
+
+    rejected = len(records) - len(valid)
+    if rejected:
+        logger.warning('Validation rejected {} of {} records'.format(rejected, len(records)))
+    return valid
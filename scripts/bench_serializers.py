@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark:  json encode / decode throughput of each serializer
+backend installed locally, measured over synthetic spot price batches
+shaped like the SpotPriceHistory records archived to Amazon S3.
+
+Usage:
+    $ python3 scripts/bench_serializers.py [batch size] [rounds]
+
+"""
+import os
+import sys
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Code'))
+
+import serializers
+
+
+azs = ['us-east-1a', 'us-east-1b', 'us-east-1c', 'us-west-2a', 'eu-west-1b', 'ap-south-1a']
+instances = ['t3.micro', 'm5.large', 'm5.2xlarge', 'c5.4xlarge', 'r5.xlarge', 'p3.2xlarge']
+products = ['Linux/UNIX', 'SUSE Linux', 'Windows', 'Red Hat Enterprise Linux']
+
+
+def price_batch(n):
+    """Generates n spot price records with timezone aware datetimes"""
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    return {
+        'SpotPriceHistory': [
+            {
+                'AvailabilityZone': random.choice(azs),
+                'InstanceType': random.choice(instances),
+                'ProductDescription': random.choice(products),
+                'SpotPrice': '{:.6f}'.format(random.uniform(0.001, 3.0)),
+                'Timestamp': start + datetime.timedelta(seconds=random.randint(0, 86400))
+            } for _ in range(n)
+        ]
+    }
+
+
+def timeit(fx, rounds):
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        result = fx()
+    return (time.perf_counter() - begin) / rounds, result
+
+
+def main(size=100000, rounds=5):
+    batch = price_batch(size)
+    print('{} records per batch, {} rounds, default backend: {}\n'.format(size, rounds, serializers.BACKEND))
+    print('{: <8} | {: >14} | {: >14} | {: >10}'.format('backend', 'encode rec/s', 'decode rec/s', 'size (MB)'))
+    print('{} | {} | {} | {}'.format('-' * 8, '-' * 14, '-' * 14, '-' * 10))
+
+    for name in sorted(serializers.BACKENDS):
+        enc, document = timeit(lambda: serializers.dumps(batch, backend=name), rounds)
+        dec, _ = timeit(lambda: serializers.loads(document, backend=name), rounds)
+        print('{: <8} | {: >14,.0f} | {: >14,.0f} | {: >10.2f}'.format(
+                name, size / enc, size / dec, len(document) / 1024 / 1024)
+            )
+
+    # baseline: archive format prior to the serializers module
+    import json
+    enc, document = timeit(lambda: json.dumps(batch, indent=4, default=str).encode('utf-8'), rounds)
+    dec, _ = timeit(lambda: json.loads(document), rounds)
+    print('{: <8} | {: >14,.0f} | {: >14,.0f} | {: >10.2f}'.format(
+            'legacy', size / enc, size / dec, len(document) / 1024 / 1024)
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
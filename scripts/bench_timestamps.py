@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark:  timestamp normalization of spot price records.
+
+Compares a per-record strftime pass (the work spotlib UtcConversion
+performs) with timestamps.normalize_timestamps() for each output style.
+
+Usage:
+    $ python3 scripts/bench_timestamps.py [records] [workers]
+
+"""
+import os
+import sys
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Code'))
+
+import timestamps
+
+
+def price_batch(n, distinct=20000):
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    stamps = [start + datetime.timedelta(seconds=random.randint(0, 86400)) for _ in range(distinct)]
+    return [
+        {'InstanceType': 'm5.large', 'SpotPrice': '0.0350', 'Timestamp': random.choice(stamps)}
+        for _ in range(n)
+    ]
+
+
+def per_record(records):
+    for record in records:
+        record['Timestamp'] = record['Timestamp'].strftime('%Y-%m-%dT%H:%M:%SZ')
+    return records
+
+
+def main(size=500000, workers=1):
+    print('{} records, {} worker process(es)\n'.format(size, workers))
+
+    batch = price_batch(size)
+    begin = time.perf_counter()
+    per_record(batch)
+    baseline = time.perf_counter() - begin
+    print('{: <22} {:8.3f}s'.format('per-record strftime', baseline))
+
+    for style in timestamps.FORMATTERS:
+        batch = price_batch(size)
+        begin = time.perf_counter()
+        timestamps.normalize_timestamps(batch, style=style, workers=workers)
+        elapsed = time.perf_counter() - begin
+        print('{: <22} {:8.3f}s  ({:.1%} of baseline)'.format('normalize ' + style, elapsed, elapsed / baseline))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark:  record validation and normalization stage.
+
+Measures validation.validate_records() inside the loader pipeline as
+cli.lambda_handler runs it between retrieval and the sinks, with the
+network I/O left out:  timestamp normalization, validation, spooling to
+the local filesystem, price sketches and the indexed archive body.  EC2
+retrieval, DynamoDB writes and S3 uploads are not measured; their
+latency dominates an ingestion run, so the share reported is an upper
+bound.  Roughly 0.1% of generated records are malformed and
+quarantined.
+
+Usage:
+    $ python3 scripts/bench_validation.py [records]
+
+"""
+import os
+import sys
+import time
+import random
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Code'))
+
+import archives
+import sketches
+import spool
+import timestamps
+import validation
+
+AZS = ['us-east-1{}'.format(x) for x in 'abcdef'] + ['eu-west-1{}'.format(x) for x in 'abc']
+TYPES = ['{}.{}'.format(f, s) for f in ('m5', 'c5', 'r5', 't3') for s in ('large', 'xlarge', '2xlarge')]
+PRODUCTS = ['Linux/UNIX', 'Linux/UNIX (Amazon VPC)', 'Windows', 'SUSE Linux', 'Red Hat Enterprise Linux']
+
+
+def price_batch(n):
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    records = [
+        {
+            'AvailabilityZone': random.choice(AZS),
+            'InstanceType': random.choice(TYPES),
+            'ProductDescription': random.choice(PRODUCTS),
+            'SpotPrice': '{:.6f}'.format(random.randint(100, 5000) / 10000),
+            'Timestamp': start + datetime.timedelta(seconds=random.randint(0, 86400))
+        } for _ in range(n)
+    ]
+    for record in random.sample(records, n // 1000):
+        random.choice([
+            lambda x: x.pop('SpotPrice'),
+            lambda x: x.update(SpotPrice='NaN'),
+            lambda x: x.update(AvailabilityZone=None)
+        ])(record)
+    return records
+
+
+def main(size=500000):
+    print('{} records\n'.format(size))
+    batch = price_batch(size)
+    stages = []
+
+    def stage(name, function, *args):
+        begin = time.perf_counter()
+        result = function(*args)
+        stages.append((name, time.perf_counter() - begin))
+        return result
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        quarantine = validation.Quarantine(os.path.join(tmpdir, 'rejected.jsonl'))
+        stage('normalize timestamps', timestamps.normalize_timestamps, batch)
+        valid = stage('validate', validation.validate_records, batch, quarantine)
+        quarantine.close()
+        stage('spool', spool.Spool(os.path.join(tmpdir, 'spotprices-bench.spool')).write, valid)
+        stage('sketches', sketches.sketch_records, valid, ['us-east-1', 'eu-west-1'])
+        stage('archive', archives.build_archive, valid)
+
+    pipeline = sum(x[1] for x in stages)
+    validate = dict(stages)['validate']
+    for name, seconds in stages:
+        print('{: <22} {:8.3f}s'.format(name, seconds))
+    print('\n{} valid, {} quarantined'.format(len(valid), quarantine.count))
+    print('validation: {:.2f} us/record, {:.1%} of the pipeline cpu stages'.format(
+        validate / size * 1e6, validate / pipeline))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
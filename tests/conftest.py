@@ -0,0 +1,9 @@
+"""
+Test configuration:  Code modules are flat (imported as top level
+modules by the Lambda runtime), so the Code directory is added to the
+import path.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Code'))
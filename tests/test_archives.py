@@ -0,0 +1,51 @@
+"""
+archives:  chunk encoding and the two level index
+"""
+from archives import build_archive, decode_chunk, index_chunks, read_archive
+
+
+def records():
+    return [
+        {'AvailabilityZone': az, 'InstanceType': itype, 'ProductDescription': 'Linux/UNIX',
+         'SpotPrice': '0.1', 'Timestamp': '2020-01-0{}T{:02d}:15:00Z'.format(day, hour)}
+        for itype in ('m5.large', 'c5.xlarge')
+        for az in ('us-east-1a', 'us-east-1b')
+        for day in (1, 2)
+        for hour in (0, 5, 23)
+    ]
+
+
+def test_index_has_one_entry_per_series():
+    body, index = build_archive(records())
+    assert index['records'] == 24
+    assert index['start'] == '2020-01-01T00'
+    assert [x[:2] for x in index['series']] == [
+        ['c5.xlarge', 'us-east-1a'], ['c5.xlarge', 'us-east-1b'],
+        ['m5.large', 'us-east-1a'], ['m5.large', 'us-east-1b']
+    ]
+    assert [x[0] for x in index['series'][0][3]] == [0, 5, 23, 24, 29, 47]
+
+
+def test_index_chunks_address_their_records():
+    body, index = build_archive(records())
+    chunks = index_chunks(index)
+    assert sum(x[5] for x in chunks) == len(records())
+    for itype, az, hour, offset, length, count in chunks:
+        decoded = decode_chunk(body[offset:offset + length])
+        assert len(decoded) == count
+        assert all(x['InstanceType'] == itype and x['AvailabilityZone'] == az for x in decoded)
+        assert all(x['Timestamp'].startswith(hour) for x in decoded)
+
+
+def test_day_chunks_compressed():
+    body, index = build_archive(records(), period='day', compress=True)
+    chunks = index_chunks(index)
+    assert index['start'] == '2020-01-01'
+    assert {x[2] for x in chunks} == {'2020-01-01', '2020-01-02'}
+    assert len(chunks) == 8
+    assert len(read_archive(body)) == len(records())
+
+
+def test_empty_archive():
+    body, index = build_archive([])
+    assert body == b'' and index_chunks(index) == []
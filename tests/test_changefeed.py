@@ -0,0 +1,49 @@
+"""
+changefeed:  detection, commit of written changes and snapshot merging
+"""
+import serializers
+from changefeed import INITIAL, KEYFRAME, TRANSITION, ChangeDetector
+
+
+def sample(ts, price, az='us-east-1a'):
+    return {
+        'AvailabilityZone': az, 'InstanceType': 'm5.large', 'ProductDescription': 'Linux/UNIX',
+        'SpotPrice': price, 'Timestamp': ts
+    }
+
+
+def test_detect_emits_transitions_and_keyframes():
+    detector = ChangeDetector(keyframe_hours=1)
+    changes = detector.detect([sample(0, '0.1'), sample(60, '0.1'), sample(120, '0.2'), sample(3720, '0.2')])
+    assert [(x['Timestamp'], x['ChangeType']) for x in changes] == [
+        (0, INITIAL), (120, TRANSITION), (3720, KEYFRAME)
+    ]
+
+
+def test_detect_leaves_state_until_commit():
+    detector = ChangeDetector()
+    changes = detector.detect([sample(0, '0.1')])
+    assert len(detector) == 0
+
+    # write failed:  the next run detects the same change again
+    assert [x['ChangeType'] for x in detector.detect([sample(0, '0.1')])] == [INITIAL]
+
+    detector.commit(changes)
+    assert detector.detect([sample(0, '0.1'), sample(60, '0.1')]) == []
+
+
+def test_commit_keeps_newest():
+    detector = ChangeDetector()
+    detector.commit([sample(120, '0.2'), sample(60, '0.1')])
+    assert detector.state[('us-east-1a', 'm5.large', 'Linux/UNIX')] == ['0.2', 120]
+
+
+def test_snapshot_merge_newest_wins():
+    older, newer = ChangeDetector(), ChangeDetector()
+    older.commit([sample(60, '0.1'), sample(60, '0.3', az='eu-west-1a')])
+    newer.commit([sample(120, '0.2')])
+
+    # a stale writer merging the stored snapshot never rolls it back
+    older.loads(newer.dumps('us-east-1'))
+    assert older.state[('us-east-1a', 'm5.large', 'Linux/UNIX')] == ['0.2', 120]
+    assert list(serializers.loads(older.dumps('eu-west-1'))) == ['eu-west-1a|m5.large|Linux/UNIX']
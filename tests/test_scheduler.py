@@ -0,0 +1,47 @@
+"""
+scheduler:  partition_schedule coverage, balance and partition spread
+"""
+import pytest
+from scheduler import _bucket, partition_schedule
+
+
+def clustered(timestamps, per_timestamp):
+    """Records arriving in long runs of one partition key, as EC2 returns them"""
+    return [
+        {'Timestamp': '2020-01-01T{:02d}:{:02d}:00Z'.format(t // 60, t % 60), 'Index': i}
+        for t in range(timestamps) for i in range(per_timestamp)
+    ]
+
+
+@pytest.mark.parametrize('workers', [1, 2, 4, 7])
+def test_every_index_scheduled_once(workers):
+    items = clustered(40, 30)
+    schedule = partition_schedule(items, workers)
+    assert len(schedule) == workers
+    assert sorted(x for worker in schedule for x in worker) == list(range(len(items)))
+
+
+@pytest.mark.parametrize('workers', [2, 4])
+def test_workers_balanced(workers):
+    items = clustered(40, 30)
+    sizes = [len(x) for x in partition_schedule(items, workers, batch_size=25)]
+    assert max(sizes) - min(sizes) <= 25
+
+
+def test_batches_spread_across_partitions():
+    items = clustered(100, 20)
+    for worker in partition_schedule(items, 4, batch_size=25):
+        for start in range(0, len(worker) - 25, 25):
+            batch = worker[start:start + 25]
+            keys = {_bucket(items[x]['Timestamp'], 256) for x in batch}
+            assert len(keys) >= 20
+
+
+def test_single_partition_key():
+    items = clustered(1, 60)
+    schedule = partition_schedule(items, 2, batch_size=25)
+    assert [len(x) for x in schedule] == [35, 25]
+
+
+def test_empty():
+    assert partition_schedule([], 3) == [[], [], []]
@@ -0,0 +1,102 @@
+"""
+sketches:  t-digest accuracy, merging and serialization round trips
+"""
+import random
+import pytest
+from sketches import SketchStore, TDigest, sketch_records
+
+
+def exact(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+@pytest.fixture
+def values():
+    rng = random.Random(7)
+    return [rng.lognormvariate(-2.5, 0.6) for _ in range(20000)]
+
+
+@pytest.mark.parametrize('q', [0.5, 0.9, 0.99])
+def test_quantile_accuracy(values, q):
+    digest = TDigest()
+    for x in values:
+        digest.add(x)
+    assert digest.quantile(q) == pytest.approx(exact(values, q), rel=0.03)
+
+
+@pytest.mark.parametrize('q', [0.5, 0.9, 0.99])
+def test_merged_digest_matches_whole(values, q):
+    parts = [TDigest() for _ in range(8)]
+    for i, x in enumerate(values):
+        parts[i % 8].add(x)
+
+    merged = TDigest()
+    for part in parts:
+        merged.merge(part)
+
+    assert merged.count == len(values)
+    assert merged.min == min(values) and merged.max == max(values)
+    assert merged.quantile(q) == pytest.approx(exact(values, q), rel=0.03)
+
+
+def test_digest_stays_bounded(values):
+    digest = TDigest(compression=100)
+    for x in values:
+        digest.add(x)
+    assert len(digest) <= 100
+
+
+def test_empty_digest_quantile():
+    assert TDigest().quantile(0.5) is None
+
+
+def test_bytes_round_trip(values):
+    digest = TDigest()
+    for x in values:
+        digest.add(x)
+    copy = TDigest.from_bytes(digest.to_bytes())
+
+    assert copy.count == digest.count
+    assert copy.min == digest.min and copy.max == digest.max
+    for q in (0.1, 0.5, 0.9, 0.99):
+        assert copy.quantile(q) == pytest.approx(digest.quantile(q), rel=1e-5)
+
+
+def test_store_round_trip():
+    store = SketchStore()
+    for i in range(100):
+        store.add('us-east-1', 'm5.large', 'Linux/UNIX', '0.0{}'.format(i % 10))
+    store.add('eu-west-1', 'c5.xlarge', 'Windows', '0.5')
+
+    copy = SketchStore.loads(store.dumps())
+    assert sorted(copy.digests) == sorted(store.digests)
+    for key, quantiles in store.quantiles().items():
+        for q, price in quantiles.items():
+            assert copy.quantiles()[key][q] == pytest.approx(price, rel=1e-5)
+
+
+def test_store_subset_and_merge():
+    a, b = SketchStore(), SketchStore()
+    a.add('us-east-1', 'm5.large', 'Linux/UNIX', '0.1')
+    b.add('us-east-1', 'm5.large', 'Linux/UNIX', '0.3')
+    b.add('us-west-2', 'm5.large', 'Linux/UNIX', '0.2')
+
+    a.merge(b)
+    assert a.regions() == ['us-east-1', 'us-west-2']
+    assert a.digests[('us-east-1', 'm5.large', 'Linux/UNIX')].count == 2
+    assert len(a.subset('us-west-2')) == 1
+
+
+def test_sketch_records_assigns_regions():
+    records = [
+        {'AvailabilityZone': 'us-east-1a', 'InstanceType': 'm5.large', 'ProductDescription': 'Linux/UNIX',
+         'SpotPrice': '0.1'},
+        {'AvailabilityZone': 'us-east-1b', 'InstanceType': 'm5.large', 'ProductDescription': 'Linux/UNIX',
+         'SpotPrice': '0.2'},
+        {'AvailabilityZone': 'eu-west-1a', 'InstanceType': 'm5.large', 'ProductDescription': 'Linux/UNIX',
+         'SpotPrice': '0.3'},
+    ]
+    store = sketch_records(records, ['us-east-1'])
+    assert store.regions() == ['us-east-1']
+    assert store.digests[('us-east-1', 'm5.large', 'Linux/UNIX')].count == 2
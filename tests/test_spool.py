@@ -0,0 +1,103 @@
+"""
+spool:  write, ack watermark, replay and stale file cleanup
+"""
+import os
+import datetime
+import pytest
+from spool import Spool, remove_stale, spool_path
+
+
+def records(n):
+    return [{'AvailabilityZone': 'us-east-1a', 'SpotPrice': '0.0{}'.format(i), 'Index': i} for i in range(n)]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / 'spotprices-test.spool'))
+
+
+def test_write_seals_and_reads_back(spool):
+    assert not spool.sealed
+    assert spool.write(records(5)) == 5
+    assert spool.sealed
+    assert [x['Index'] for _, _, x in spool.read()] == list(range(5))
+
+
+def test_pending_returns_offsets(spool):
+    spool.write(records(3))
+    pending, offsets = spool.pending('dynamodb')
+    assert len(pending) == len(offsets) == 3
+    assert offsets[0][0] == 0
+    assert all(a[1] == b[0] for a, b in zip(offsets, offsets[1:]))
+
+
+def test_ack_advances_only_through_contiguous_ranges(spool):
+    spool.write(records(4))
+    _, offsets = spool.pending('dynamodb')
+
+    spool.ack('dynamodb', [offsets[1], offsets[3]])
+    assert spool.committed('dynamodb') == 0
+
+    spool.ack('dynamodb', [offsets[0]])
+    assert spool.committed('dynamodb') == offsets[1][1]
+
+    spool.ack('dynamodb', [offsets[2]])
+    assert spool.committed('dynamodb') == offsets[3][1]
+
+
+def test_replay_after_restart_skips_committed_records(spool):
+    spool.write(records(4))
+    _, offsets = spool.pending('dynamodb')
+    spool.ack('dynamodb', offsets[:2])
+
+    replay = Spool(spool.path)
+    assert replay.sealed
+    pending, _ = replay.pending('dynamodb')
+    assert [x['Index'] for x in pending] == [2, 3]
+
+
+def test_sinks_are_tracked_independently(spool):
+    spool.write(records(2))
+    _, offsets = spool.pending('dynamodb')
+    spool.ack('dynamodb', offsets)
+    assert spool.pending('dynamodb')[0] == []
+    assert len(spool.pending('s3')[0]) == 2
+
+
+def test_truncated_record_is_not_replayed(spool):
+    spool.write(records(3))
+    size = os.path.getsize(spool.path)
+    with open(spool.path, 'r+b') as f1:
+        f1.truncate(size - 2)
+    assert [x['Index'] for _, _, x in spool.read()] == [0, 1]
+
+
+def test_write_resets_previous_state(spool):
+    spool.write(records(2))
+    spool.ack('dynamodb', spool.pending('dynamodb')[1])
+    spool.write(records(3))
+    assert spool.committed('dynamodb') == 0
+    assert len(spool.pending('dynamodb')[0]) == 3
+
+
+def test_remove(spool):
+    spool.write(records(1))
+    spool.remove()
+    assert not spool.sealed
+    assert not os.path.exists(spool.state_path)
+
+
+def test_spool_path_is_order_independent():
+    start, end = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2)
+    assert spool_path(['us-east-1', 'eu-west-1'], start, end) == spool_path(['eu-west-1', 'us-east-1'], start, end)
+    assert spool_path(['us-east-1'], start, end) != spool_path(['us-east-1'], start, end + datetime.timedelta(days=1))
+
+
+def test_remove_stale_keeps_current_spool(tmp_path):
+    names = ['spotprices-a.spool', 'spotprices-a.spool.state', 'spotprices-b.spool', 'spotprices-b.spool.state', 'other.txt']
+    for name in names:
+        (tmp_path / name).write_bytes(b'')
+    current = str(tmp_path / 'spotprices-b.spool')
+
+    assert remove_stale(current, str(tmp_path)) == 2
+    assert sorted(os.listdir(tmp_path)) == ['other.txt', 'spotprices-b.spool', 'spotprices-b.spool.state']
@@ -0,0 +1,83 @@
+"""
+validation:  reject paths, normalization and the quarantine file
+"""
+import datetime
+import pytest
+import serializers
+from timestamps import normalize_timestamps
+from validation import Quarantine, price_value, timestamp_value, validate_records
+
+
+def record(**fields):
+    base = {
+        'AvailabilityZone': 'us-east-1a',
+        'InstanceType': 'm5.large',
+        'ProductDescription': 'Linux/UNIX',
+        'SpotPrice': '0.0960',
+        'Timestamp': '2020-01-01T05:00:00Z'
+    }
+    base.update(fields)
+    return base
+
+
+@pytest.mark.parametrize('bad, reason', [
+    ('not a record', 'not a mapping'),
+    ({'AvailabilityZone': 'us-east-1a'}, 'missing fields'),
+    (record(AvailabilityZone=None), 'invalid AvailabilityZone'),
+    (record(InstanceType='  '), 'invalid InstanceType'),
+    (record(ProductDescription=3), 'invalid ProductDescription'),
+    (record(SpotPrice=0.1), 'invalid SpotPrice type'),
+    (record(SpotPrice='NaN'), 'invalid SpotPrice'),
+    (record(SpotPrice='-0.1'), 'invalid SpotPrice'),
+    (record(SpotPrice='1e-3'), 'invalid SpotPrice'),
+    (record(SpotPrice='1_000'), 'invalid SpotPrice'),
+    (record(SpotPrice=''), 'invalid SpotPrice'),
+    (record(Timestamp=''), 'invalid Timestamp'),
+    (record(Timestamp='not-a-time'), 'invalid Timestamp'),
+    (record(Timestamp=None), 'invalid Timestamp'),
+    (record(Timestamp=1.5), 'invalid Timestamp'),
+    (record(Timestamp=['2020-01-01T05:00:00Z']), 'invalid Timestamp'),
+])
+def test_rejected_and_quarantined(tmp_path, bad, reason):
+    quarantine = Quarantine(str(tmp_path / 'rejected.jsonl'))
+    assert validate_records([bad, record()], quarantine) == [record()]
+    assert quarantine.close() == 1
+
+    with open(quarantine.path, 'rb') as f1:
+        rejected = serializers.loads(f1.readline())
+    assert rejected['reason'].startswith(reason)
+    assert rejected['record'] == bad
+
+
+def test_rejects_dropped_without_quarantine():
+    assert validate_records([record(SpotPrice='NaN'), record(Timestamp='')]) == []
+
+
+@pytest.mark.parametrize('timestamp', ['2020-01-01T05:00:00Z', '2020-01-01 05:00:00', '1577854800', 1577854800])
+def test_timestamp_styles_accepted(timestamp):
+    assert validate_records([record(Timestamp=timestamp)])
+    assert timestamp_value(timestamp) == 1577854800
+
+
+def test_normalized_timestamps_accepted():
+    records = [record(Timestamp=datetime.datetime(2020, 1, 1, 5, tzinfo=datetime.timezone.utc))]
+    normalize_timestamps(records, style='epoch')
+    assert validate_records(records)[0]['Timestamp'] == '1577854800'
+
+
+def test_fields_stripped_and_interned():
+    first = record(AvailabilityZone=' us-east-1b ', SpotPrice=' 0.1 ')
+    second = record(AvailabilityZone=' us-east-1b ')
+    valid = validate_records([first, second])
+
+    assert [x['AvailabilityZone'] for x in valid] == ['us-east-1b', 'us-east-1b']
+    assert valid[0]['AvailabilityZone'] is valid[1]['AvailabilityZone']
+    assert valid[0]['SpotPrice'] == '0.1'
+
+
+def test_price_value():
+    assert price_value('0.0960') == pytest.approx(0.096)
+    assert price_value('.5') == 0.5
+    for bad in (' 0.1 ', 'inf', '0x1', None):
+        with pytest.raises(ValueError):
+            price_value(bad)